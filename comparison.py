@@ -2,29 +2,49 @@
 
 from __future__ import annotations
 
-from dataclasses import dataclass
+import heapq
+import re
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
+from functools import lru_cache
+from hashlib import blake2b
 from io import BytesIO
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 from uuid import uuid4
 
 import numpy as np
 import pandas as pd
 from fpdf import FPDF
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
 from openpyxl.utils import column_index_from_string
 
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional; fall back to the NumPy kernel
+    njit = None
 
+
+_NORMALIZE_TABLE = str.maketrans(
+    {char: "_" for char in map(chr, range(128)) if not char.isalnum()}
+)
+_NON_WORD_RE = re.compile(r"\W")
+
+
+# typed=True keeps headers such as 1 and 1.0, which stringify differently, apart.
+@lru_cache(maxsize=4096, typed=True)
 def _normalize_column_name(column: Any) -> str:
     """Normalize a column header into snake case for easier matching."""
     text = str(column or "").strip().lower()
-    normalized: List[str] = []
-    for char in text:
-        if char.isalnum():
-            normalized.append(char)
-        else:
-            normalized.append("_")
-    value = "".join(normalized).strip("_")
-    return value or "column"
+    if text.isascii():
+        text = text.translate(_NORMALIZE_TABLE)
+    else:
+        # \W is exactly "not alphanumeric and not underscore" for str patterns.
+        text = _NON_WORD_RE.sub("_", text)
+    return text.strip("_") or "column"
 
 
 def _pretty_label(column: str) -> str:
@@ -39,18 +59,316 @@ def _format_currency(value: float) -> str:
     return f"${value:,.2f}"
 
 
+def _round_list(values: np.ndarray) -> List[Any]:
+    """Round to cents in one pass and convert to Python lists, NaN becoming None."""
+    rounded = np.round(values.astype(np.float64), 2)
+    if np.isnan(rounded).any():
+        return np.where(np.isnan(rounded), None, rounded).tolist()
+    return rounded.tolist()
+
+
+def _mean_std0(values: np.ndarray) -> Tuple[Any, Any]:
+    """Population mean and standard deviation from one sum/sum-of-squares pass.
+
+    2-D input is reduced per column and yields arrays instead of floats.
+    """
+    # Shifting by the first row keeps the shortcut formula from cancelling
+    # catastrophically and makes constant inputs come out at exactly zero.
+    shifted = values - values[0]
+    count = len(shifted)
+    shifted_mean = shifted.sum(axis=0) / count
+    variance = np.einsum("i...,i...->...", shifted, shifted) / count
+    variance -= shifted_mean * shifted_mean
+    return values[0] + shifted_mean, np.sqrt(np.maximum(variance, 0.0))
+
+
 def _format_percentage(value: Optional[float]) -> str:
     if value is None or np.isnan(value):
         return "-"
     return f"{value:.2f}%"
 
 
-@dataclass
+_COST_STATUS_LABELS = np.array(
+    ["Registered", "Partial", "Missing", "Unregistered"], dtype=object
+)
+
+
+def _classify_costs_numpy(
+    formatted: np.ndarray, comparison: np.ndarray, epsilon: float
+) -> Tuple[np.ndarray, ...]:
+    """Classify each (deal, cost) cell of the formatted/comparison matrices.
+
+    Returns status codes indexing ``_COST_STATUS_LABELS`` followed by the
+    difference, percentage, missing, greater and unregistered matrices.
+    """
+    difference = formatted - comparison
+    has_formatted = np.abs(formatted) > epsilon
+    has_comparison = np.abs(comparison) > epsilon
+    missing = has_comparison & ~has_formatted
+    greater = has_formatted & (difference > epsilon)
+    unregistered = has_formatted & ~has_comparison
+    safe_comparison = np.where(has_comparison, comparison, 1.0)
+    percentage = np.where(has_comparison, difference / safe_comparison * 100, np.nan)
+    partial = (
+        has_comparison
+        & (np.abs(difference) > epsilon)
+        & (np.abs(difference) / np.abs(safe_comparison) * 100 >= 5)
+    )
+    status = np.select([unregistered, missing, partial], [3, 2, 1], default=0)
+    return (
+        status.astype(np.int8),
+        difference,
+        percentage,
+        missing,
+        greater,
+        unregistered,
+    )
+
+
+if njit is not None:
+
+    @njit(parallel=True, cache=True)
+    def _classify_costs(
+        formatted: np.ndarray, comparison: np.ndarray, epsilon: float
+    ) -> Tuple[np.ndarray, ...]:
+        """Single-pass JIT equivalent of ``_classify_costs_numpy``."""
+        rows, columns = formatted.shape
+        status = np.zeros((rows, columns), dtype=np.int8)
+        difference = np.empty((rows, columns), dtype=np.float64)
+        percentage = np.empty((rows, columns), dtype=np.float64)
+        missing = np.zeros((rows, columns), dtype=np.bool_)
+        greater = np.zeros((rows, columns), dtype=np.bool_)
+        unregistered = np.zeros((rows, columns), dtype=np.bool_)
+
+        for row in prange(rows):
+            for column in range(columns):
+                formatted_value = formatted[row, column]
+                comparison_value = comparison[row, column]
+                diff = formatted_value - comparison_value
+                has_formatted = abs(formatted_value) > epsilon
+                has_comparison = abs(comparison_value) > epsilon
+
+                difference[row, column] = diff
+                if has_comparison:
+                    percentage[row, column] = diff / comparison_value * 100
+                else:
+                    percentage[row, column] = np.nan
+                greater[row, column] = has_formatted and diff > epsilon
+
+                if has_formatted and not has_comparison:
+                    unregistered[row, column] = True
+                    status[row, column] = 3
+                elif has_comparison and not has_formatted:
+                    missing[row, column] = True
+                    status[row, column] = 2
+                elif (
+                    has_comparison
+                    and abs(diff) > epsilon
+                    and abs(diff) / abs(comparison_value) * 100 >= 5
+                ):
+                    status[row, column] = 1
+
+        return status, difference, percentage, missing, greater, unregistered
+
+else:
+    _classify_costs = _classify_costs_numpy
+
+
+# Heatmap cell states: 0-4 are the percentage buckets, 5 only has a formatted
+# amount, 6 only has a comparison amount and 7 has neither.
+_HEATMAP_BINS = np.array([-20.0, -5.0, 5.0, 20.0])
+_HEATMAP_LABELS = np.array(
+    [
+        ">20% Lower",
+        "5-20% Lower",
+        "Within",
+        "5-20% Higher",
+        ">20% Higher",
+        "Unregistered",
+        "Missing",
+        "Within",
+    ],
+    dtype=object,
+)
+_HEATMAP_VALUES = np.array([-2, -1, 0, 1, 2, -10, -1, 0])
+
+
+def _heatmap_states_numpy(
+    formatted: np.ndarray, comparison: np.ndarray, epsilon: float
+) -> np.ndarray:
+    """Return the ``_HEATMAP_LABELS`` state of each (deal, cost) cell."""
+    has_formatted = np.abs(formatted) > epsilon
+    has_comparison = np.abs(comparison) > epsilon
+    percentage = np.where(
+        has_comparison,
+        (formatted - comparison) / np.where(has_comparison, comparison, 1.0) * 100,
+        0.0,
+    )
+    # Lower buckets include their -5/-20 edge, higher buckets their 5/20 edge.
+    bucket = np.where(
+        percentage < 0,
+        np.digitize(percentage, _HEATMAP_BINS, right=True),
+        np.digitize(percentage, _HEATMAP_BINS),
+    )
+    return np.select(
+        [
+            has_formatted & ~has_comparison,
+            has_comparison & ~has_formatted,
+            ~has_formatted & ~has_comparison,
+        ],
+        [5, 6, 7],
+        default=bucket,
+    ).astype(np.int8)
+
+
+if njit is not None:
+
+    @njit(parallel=True, cache=True)
+    def _heatmap_states(
+        formatted: np.ndarray, comparison: np.ndarray, epsilon: float
+    ) -> np.ndarray:
+        """Single-pass JIT equivalent of ``_heatmap_states_numpy``."""
+        rows, columns = formatted.shape
+        state = np.empty((rows, columns), dtype=np.int8)
+
+        for row in prange(rows):
+            for column in range(columns):
+                formatted_value = formatted[row, column]
+                comparison_value = comparison[row, column]
+                has_formatted = abs(formatted_value) > epsilon
+                has_comparison = abs(comparison_value) > epsilon
+
+                if has_formatted and not has_comparison:
+                    state[row, column] = 5
+                elif has_comparison and not has_formatted:
+                    state[row, column] = 6
+                elif not has_comparison:
+                    state[row, column] = 7
+                else:
+                    pct = (formatted_value - comparison_value) / comparison_value * 100
+                    if pct < 0:
+                        if pct <= -20:
+                            state[row, column] = 0
+                        elif pct <= -5:
+                            state[row, column] = 1
+                        else:
+                            state[row, column] = 2
+                    elif pct < 5:
+                        state[row, column] = 2
+                    elif pct < 20:
+                        state[row, column] = 3
+                    else:
+                        # NaN lands here too, matching np.digitize.
+                        state[row, column] = 4
+
+        return state
+
+else:
+    _heatmap_states = _heatmap_states_numpy
+
+
+_HEADER_FONT = Font(bold=True)
+_HEADER_BORDER = Border(
+    left=Side(style="thin"),
+    right=Side(style="thin"),
+    top=Side(style="thin"),
+    bottom=Side(style="thin"),
+)
+_HEADER_ALIGNMENT = Alignment(horizontal="center", vertical="top")
+
+
+def _excel_value(value: Any) -> Any:
+    """Convert a DataFrame value into something openpyxl can serialise."""
+    if isinstance(value, (list, tuple, dict, set)):
+        return str(value)
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return value
+
+
+def _write_frame(workbook: Workbook, title: str, frame: pd.DataFrame) -> None:
+    """Append ``frame`` to a new write-only worksheet, styled like ``to_excel``."""
+    worksheet = workbook.create_sheet(title=title)
+    if len(frame.columns):
+        header = []
+        for column in frame.columns:
+            cell = WriteOnlyCell(worksheet, value=column)
+            cell.font = _HEADER_FONT
+            cell.border = _HEADER_BORDER
+            cell.alignment = _HEADER_ALIGNMENT
+            header.append(cell)
+        worksheet.append(header)
+
+    for row in frame.itertuples(index=False, name=None):
+        worksheet.append([_excel_value(value) for value in row])
+
+
+@dataclass(slots=True)
 class CostColumn:
     key: str
     label: str
     formatted_column: Optional[str] = None
     comparison_column: Optional[str] = None
+    # Names of this cost's columns in the merged frame, resolved once.
+    merged_formatted_column: str = field(init=False, repr=False)
+    merged_comparison_column: str = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.merged_formatted_column = f"cost_{self.key}_formatted"
+        self.merged_comparison_column = f"cost_{self.key}_comparison"
+
+
+def _excel_read_engine() -> str:
+    """Prefer the Rust calamine reader when pandas and python-calamine support it.
+
+    pandas' openpyxl reader already opens workbooks read-only with cached
+    values, so it remains the fallback.
+    """
+    try:
+        import python_calamine  # noqa: F401
+    except ImportError:
+        return "openpyxl"
+    major, minor = (int(part) for part in pd.__version__.split(".")[:2])
+    return "calamine" if (major, minor) >= (2, 2) else "openpyxl"
+
+
+_EXCEL_READ_ENGINE = _excel_read_engine()
+
+
+# Parsed worksheets keyed by (upload digest, sheet name), least recently used first
+_SHEET_CACHE_MAX = 8
+_sheet_cache: OrderedDict[Tuple[bytes, Optional[str]], pd.DataFrame] = OrderedDict()
+_sheet_cache_lock = threading.Lock()
+
+
+def _read_workbook_sheet(file_bytes: bytes, sheet_name: Optional[str]) -> pd.DataFrame:
+    """Parse a worksheet once per upload digest and sheet name.
+
+    Only the parsed frame is kept, for at most ``_SHEET_CACHE_MAX`` sheets; the
+    uploaded bytes are never retained.
+    """
+    key = (blake2b(file_bytes, digest_size=16).digest(), sheet_name)
+
+    with _sheet_cache_lock:
+        cached = _sheet_cache.get(key)
+        if cached is not None:
+            _sheet_cache.move_to_end(key)
+            return cached
+
+    df = pd.read_excel(
+        BytesIO(file_bytes),
+        sheet_name=sheet_name if sheet_name else 0,
+        dtype=object,
+        engine=_EXCEL_READ_ENGINE,
+    ).dropna(how="all")
+
+    with _sheet_cache_lock:
+        _sheet_cache[key] = df
+        _sheet_cache.move_to_end(key)
+        while len(_sheet_cache) > _SHEET_CACHE_MAX:
+            _sheet_cache.popitem(last=False)
+
+    return df
 
 
 class DealComparisonAnalyzer:
@@ -65,9 +383,11 @@ class DealComparisonAnalyzer:
         "fee",
         "logistics",
     )
+    _COST_PATTERN = re.compile("|".join(map(re.escape, COST_KEYWORDS)))
 
-    def __init__(self) -> None:
-        self._cache: Dict[str, Dict[str, Any]] = {}
+    def __init__(self, cache_max: int = 16) -> None:
+        self._cache: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+        self._cache_max = cache_max
 
     # ------------------------------------------------------------------
     # Public API
@@ -84,11 +404,12 @@ class DealComparisonAnalyzer:
     ) -> Dict[str, Any]:
         """Run the complete comparison workflow and return JSON payload."""
 
-        df_formatted_raw = self._load_dataframe(formatted_bytes, formatted_sheet)
-        df_comparison_raw = self._load_dataframe(comparison_bytes, comparison_sheet)
-
-        df_formatted, formatted_meta = self._standardize_dataframe(df_formatted_raw)
-        df_comparison, comparison_meta = self._standardize_dataframe(df_comparison_raw)
+        df_formatted, formatted_meta = self._standardize_dataframe(
+            self._load_dataframe(formatted_bytes, formatted_sheet)
+        )
+        df_comparison, comparison_meta = self._standardize_dataframe(
+            self._load_dataframe(comparison_bytes, comparison_sheet)
+        )
 
         deal_col_formatted = self._identify_deal_column(df_formatted)
         deal_col_comparison = self._identify_deal_column(df_comparison)
@@ -140,79 +461,98 @@ class DealComparisonAnalyzer:
             "dataframe": merged,
             "cost_info": cost_info,
             "payload": results,
+            "exports": {},
         }
+        self._cache.move_to_end(token)
+        while len(self._cache) > self._cache_max:
+            self._cache.popitem(last=False)
         results["token"] = token
         return results
 
     def get_cached_payload(self, token: str) -> Dict[str, Any]:
         if token not in self._cache:
             raise KeyError("Analysis token not found")
+        self._cache.move_to_end(token)
         return self._cache[token]
 
     def generate_excel(self, token: str) -> bytes:
-        cached = self.get_cached_payload(token)
-        merged: pd.DataFrame = cached["dataframe"]
-        cost_info: Dict[str, CostColumn] = cached["cost_info"]
-        payload: Dict[str, Any] = cached["payload"]
+        return self._cached_export(token, "excel", self._render_excel)
 
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine="openpyxl") as writer:
-            overview_df = pd.DataFrame(
-                [
-                    {
-                        "Metric": "Deals with variance",
-                        "Value": payload["overview"]["total_deals"],
-                    },
-                    {
-                        "Metric": "Total USD discrepancy",
-                        "Value": payload["overview"]["total_difference"],
-                    },
-                    {
-                        "Metric": "Average variance %",
-                        "Value": payload["overview"]["average_variance"],
-                    },
-                    {
-                        "Metric": "Unregistered cost types",
-                        "Value": payload["overview"]["unregistered_cost_types"],
-                    },
-                ]
-            )
-            overview_df.to_excel(writer, sheet_name="Overview", index=False)
+    def generate_csv(self, token: str) -> bytes:
+        return self._cached_export(token, "csv", self._render_csv)
 
-            deals_df = pd.DataFrame(payload["deals"])
-            deals_df.to_excel(writer, sheet_name="Deal Differences", index=False)
+    def generate_pdf(self, token: str) -> bytes:
+        return self._cached_export(token, "pdf", self._render_pdf)
 
-            breakdown_df = pd.DataFrame(payload["cost_breakdown"])
-            breakdown_df.to_excel(writer, sheet_name="Cost Breakdown", index=False)
+    # ------------------------------------------------------------------
+    # Export rendering
+    # ------------------------------------------------------------------
+    def _cached_export(
+        self, token: str, kind: str, render: Callable[[Dict[str, Any]], bytes]
+    ) -> bytes:
+        """Render an export once per analysis and serve repeats from the cache."""
+        cached = self.get_cached_payload(token)
+        exports: Dict[str, bytes] = cached["exports"]
+        if kind not in exports:
+            exports[kind] = render(cached)
+        return exports[kind]
 
-            unregistered_df = pd.DataFrame(payload["unregistered_costs"])
-            unregistered_df.to_excel(
-                writer, sheet_name="Unregistered Costs", index=False
-            )
+    def _render_excel(self, cached: Dict[str, Any]) -> bytes:
+        merged: pd.DataFrame = cached["dataframe"]
+        cost_info: Dict[str, CostColumn] = cached["cost_info"]
+        payload: Dict[str, Any] = cached["payload"]
 
-            heatmap = payload["heatmap"]
-            matrix_df = pd.DataFrame(
-                heatmap["status_matrix"],
-                columns=heatmap["cost_types"],
-                index=heatmap["deal_ids"],
-            )
-            matrix_df.index.name = "Deal"
-            matrix_df.reset_index().to_excel(
-                writer, sheet_name="Heatmap", index=False
-            )
+        overview_df = pd.DataFrame(
+            [
+                {
+                    "Metric": "Deals with variance",
+                    "Value": payload["overview"]["total_deals"],
+                },
+                {
+                    "Metric": "Total USD discrepancy",
+                    "Value": payload["overview"]["total_difference"],
+                },
+                {
+                    "Metric": "Average variance %",
+                    "Value": payload["overview"]["average_variance"],
+                },
+                {
+                    "Metric": "Unregistered cost types",
+                    "Value": payload["overview"]["unregistered_cost_types"],
+                },
+            ]
+        )
 
-            merged.to_excel(writer, sheet_name="Raw Data", index=False)
+        heatmap = payload["heatmap"]
+        matrix_df = pd.DataFrame(
+            heatmap["status_matrix"],
+            columns=heatmap["cost_types"],
+            index=heatmap["deal_ids"],
+        )
+        matrix_df.index.name = "Deal"
+
+        # Write-only mode streams rows to the archive instead of keeping a
+        # Cell object per value, which matters for the Raw Data sheet.
+        workbook = Workbook(write_only=True)
+        _write_frame(workbook, "Overview", overview_df)
+        _write_frame(workbook, "Deal Differences", pd.DataFrame(payload["deals"]))
+        _write_frame(workbook, "Cost Breakdown", pd.DataFrame(payload["cost_breakdown"]))
+        _write_frame(
+            workbook, "Unregistered Costs", pd.DataFrame(payload["unregistered_costs"])
+        )
+        _write_frame(workbook, "Heatmap", matrix_df.reset_index())
+        _write_frame(workbook, "Raw Data", merged)
 
+        output = BytesIO()
+        workbook.save(output)
         return output.getvalue()
 
-    def generate_csv(self, token: str) -> bytes:
-        cached = self.get_cached_payload(token)
+    def _render_csv(self, cached: Dict[str, Any]) -> bytes:
         payload: Dict[str, Any] = cached["payload"]
         deals_df = pd.DataFrame(payload["deals"])
         return deals_df.to_csv(index=False).encode("utf-8")
 
-    def generate_pdf(self, token: str) -> bytes:
-        cached = self.get_cached_payload(token)
+    def _render_pdf(self, cached: Dict[str, Any]) -> bytes:
         payload: Dict[str, Any] = cached["payload"]
         summary = payload["summary_report"]
 
@@ -232,10 +572,12 @@ class DealComparisonAnalyzer:
         pdf.set_font("Helvetica", "B", 12)
         pdf.cell(0, 8, "Recommended Actions", ln=True)
         pdf.set_font("Helvetica", size=12)
-        for item in summary["recommended_actions"]:
-            pdf.multi_cell(0, 6, f"• {item}")
+        # Core fonts are Latin-1 only, so the bullet glyph is a plain hyphen.
+        pdf.multi_cell(
+            0, 6, "\n".join(f"- {item}" for item in summary["recommended_actions"])
+        )
 
-        return pdf.output(dest="S").encode("latin-1")
+        return bytes(pdf.output())
 
     # ------------------------------------------------------------------
     # Helpers
@@ -245,18 +587,13 @@ class DealComparisonAnalyzer:
     ) -> pd.DataFrame:
         if not file_bytes:
             raise ValueError("Uploaded file is empty")
-        excel_stream = BytesIO(file_bytes)
-        df = pd.read_excel(
-            excel_stream,
-            sheet_name=sheet_name if sheet_name else 0,
-            dtype=object,
-        )
-        df = df.dropna(how="all")
-        return df
+        # Shallow copy so callers can relabel columns without touching the cache.
+        return _read_workbook_sheet(file_bytes, sheet_name).copy(deep=False)
 
     def _standardize_dataframe(
         self, df: pd.DataFrame
     ) -> Tuple[pd.DataFrame, Dict[str, Dict[str, str]]]:
+        """Relabel ``df`` columns in place with unique snake-case names."""
         columns: List[str] = []
         original: Dict[str, str] = {}
         display: Dict[str, str] = {}
@@ -274,9 +611,8 @@ class DealComparisonAnalyzer:
             original[base] = str(column)
             display[base] = _pretty_label(str(column))
 
-        standardized = df.copy()
-        standardized.columns = columns
-        return standardized, {"original": original, "display": display}
+        df.columns = columns
+        return df, {"original": original, "display": display}
 
     def _identify_deal_column(self, df: pd.DataFrame) -> str:
         priority = (
@@ -288,8 +624,9 @@ class DealComparisonAnalyzer:
             "dealname",
             "vsa_deal",
         )
+        columns = frozenset(df.columns)
         for name in priority:
-            if name in df.columns:
+            if name in columns:
                 return name
 
         for column in df.columns:
@@ -334,13 +671,14 @@ class DealComparisonAnalyzer:
         except ValueError:
             pass
 
-        numeric_columns = [
-            column
-            for column in df.columns
-            if pd.to_numeric(df[column], errors="coerce").notna().any()
-        ]
-        if numeric_columns:
-            return numeric_columns[0]
+        # Stop at the first column holding any numeric value; only columns that
+        # are not numeric already need coercing to find out.
+        for column in df.columns:
+            values = df[column]
+            if not pd.api.types.is_numeric_dtype(values):
+                values = pd.to_numeric(values, errors="coerce")
+            if values.notna().any():
+                return column
 
         raise ValueError("Unable to locate quantity column in comparison sheet")
 
@@ -349,9 +687,7 @@ class DealComparisonAnalyzer:
     ) -> List[str]:
         cost_columns: List[str] = []
         for column in df.columns:
-            if column == quantity_column:
-                continue
-            if any(keyword in column for keyword in self.COST_KEYWORDS):
+            if column != quantity_column and self._COST_PATTERN.search(column):
                 cost_columns.append(column)
         return cost_columns
 
@@ -392,33 +728,54 @@ class DealComparisonAnalyzer:
         quantity_column: str,
         cost_columns: Iterable[str],
     ) -> pd.DataFrame:
-        numeric_columns = [quantity_column, *cost_columns]
-        subset = df[[deal_column, *numeric_columns]].copy()
-
-        for column in numeric_columns:
-            subset[column] = pd.to_numeric(subset[column], errors="coerce").fillna(0)
-
-        grouped = subset.groupby(deal_column, dropna=False).sum().reset_index()
-        grouped = grouped.rename(columns={deal_column: "deal_id"})
-        grouped = grouped.rename(columns={quantity_column: "total_quantity"})
-
-        renamed = {}
+        rename_map = {deal_column: "deal_id", quantity_column: "total_quantity"}
         for column in cost_columns:
-            key = _normalize_column_name(column)
-            renamed[column] = f"cost_{key}"
+            rename_map[column] = f"cost_{_normalize_column_name(column)}"
+
+        # Coerce every numeric column straight into one float64 block, blanks
+        # and text becoming 0, so the groupby sums a single contiguous array.
+        source_columns = list(rename_map)[1:]
+        values = (
+            df[source_columns]
+            .apply(pd.to_numeric, errors="coerce")
+            .to_numpy(dtype=np.float64, na_value=0.0)
+        )
+        subset = pd.DataFrame(values, columns=[rename_map[c] for c in source_columns])
+        subset.insert(0, "deal_id", df[deal_column].to_numpy())
 
-        return grouped.rename(columns=renamed)
+        return subset.groupby("deal_id", as_index=False, sort=False, dropna=False).sum()
 
     def _merge_datasets(
         self, formatted: pd.DataFrame, comparison: pd.DataFrame
     ) -> pd.DataFrame:
-        merged = formatted.merge(
-            comparison,
-            on="deal_id",
-            how="outer",
-            suffixes=("_formatted", "_comparison"),
+        # Shared categories let the outer join hash integer codes, not strings.
+        deal_dtype = pd.CategoricalDtype(
+            pd.concat([formatted["deal_id"], comparison["deal_id"]]).dropna().unique()
+        )
+        for dataset in (formatted, comparison):
+            dataset["deal_id"] = dataset["deal_id"].astype(deal_dtype)
+
+        # Deal ids are unique per side after the groupby, so the outer join is
+        # two reindexes onto the union: formatted deals first, then deals only
+        # the comparison workbook has, matching merge(how="outer", sort=False).
+        formatted = formatted.set_index("deal_id")
+        comparison = comparison.set_index("deal_id")
+        shared = formatted.columns.intersection(comparison.columns)
+        formatted = formatted.rename(columns={c: f"{c}_formatted" for c in shared})
+        comparison = comparison.rename(columns={c: f"{c}_comparison" for c in shared})
+        deal_index = formatted.index.append(
+            comparison.index[~comparison.index.isin(formatted.index)]
         )
-        merged = merged.fillna(0)
+        merged = pd.concat(
+            [formatted.reindex(deal_index), comparison.reindex(deal_index)], axis=1
+        ).reset_index()
+        merged.fillna(dict.fromkeys(merged.columns.drop("deal_id"), 0), inplace=True)
+        if merged["deal_id"].isna().any():
+            # Blank deal identifiers are reported as 0, as before categorisation.
+            missing_category = [] if 0 in deal_dtype.categories else [0]
+            merged["deal_id"] = (
+                merged["deal_id"].cat.add_categories(missing_category).fillna(0)
+            )
 
         merged["quantity_difference"] = (
             merged["total_quantity_formatted"] - merged["total_quantity_comparison"]
@@ -430,17 +787,31 @@ class DealComparisonAnalyzer:
              / merged["total_quantity_comparison"]) * 100,
         )
         merged["abs_difference"] = merged["quantity_difference"].abs()
-        merged.sort_values("abs_difference", ascending=False, inplace=True)
 
-        if len(merged):
-            merged["rank"] = (
-                merged["abs_difference"].rank(method="first", ascending=False).astype(int)
-            )
-        else:
-            merged["rank"] = []
+        # One stable sort yields both the ordering and a first-come 1..n rank.
+        order = np.argsort(-merged["abs_difference"].to_numpy(), kind="stable")
+        merged = merged.iloc[order]
+        merged["rank"] = np.arange(1, len(merged) + 1)
 
         return merged
 
+    def _cost_matrices(
+        self, df: pd.DataFrame, cost_columns: List[CostColumn]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Return formatted and comparison cost values as (deals x costs) arrays."""
+        formatted = df.reindex(
+            columns=[cost.merged_formatted_column for cost in cost_columns],
+            fill_value=0.0,
+        ).to_numpy(dtype=np.float64, na_value=0.0)
+        comparison = df.reindex(
+            columns=[cost.merged_comparison_column for cost in cost_columns],
+            fill_value=0.0,
+        ).to_numpy(dtype=np.float64, na_value=0.0)
+
+        formatted[:, [not cost.formatted_column for cost in cost_columns]] = 0.0
+        comparison[:, [not cost.comparison_column for cost in cost_columns]] = 0.0
+        return formatted, comparison
+
     def _build_analysis_payload(
         self, merged: pd.DataFrame, cost_info: Dict[str, CostColumn]
     ) -> Dict[str, Any]:
@@ -457,78 +828,89 @@ class DealComparisonAnalyzer:
         }
         deals_payload: List[Dict[str, Any]] = []
         unregistered_cost_tracker: Dict[str, Dict[str, Any]] = {}
-        analysis_indices: List[Any] = []
 
         epsilon = 1e-6
-        for idx, row in merged.iterrows():
-            deal_id = row["deal_id"]
-            cost_details: List[Dict[str, Any]] = []
-            unregistered_for_deal: List[str] = []
-            partial_for_deal: List[str] = []
-            missing_for_deal: List[str] = []
-            greater_for_deal: List[str] = []
-
-            difference_value = float(row.get("quantity_difference", 0.0))
-            has_difference = abs(difference_value) > epsilon
-
-            for cost in cost_columns:
-                formatted_raw = (
-                    row.get(f"cost_{cost.key}_formatted", 0.0)
-                    if cost.formatted_column
-                    else 0.0
-                )
-                comparison_raw = (
-                    row.get(f"cost_{cost.key}_comparison", 0.0)
-                    if cost.comparison_column
-                    else 0.0
-                )
-
-                formatted_value = (
-                    float(formatted_raw) if pd.notna(formatted_raw) else 0.0
-                )
-                comparison_value = (
-                    float(comparison_raw) if pd.notna(comparison_raw) else 0.0
-                )
-
-                difference = formatted_value - comparison_value
-                percentage = (
-                    (difference / comparison_value * 100)
-                    if abs(comparison_value) > epsilon
-                    else (np.nan if abs(formatted_value) <= epsilon else np.nan)
-                )
-
-                has_formatted = abs(formatted_value) > epsilon
-                has_comparison = abs(comparison_value) > epsilon
-                missing_flag = has_comparison and not has_formatted
-                greater_flag = has_formatted and (difference > epsilon)
-                unregistered_flag = has_formatted and not has_comparison
-
-                status = "Registered"
-                if unregistered_flag:
-                    status = "Unregistered"
-                    unregistered_for_deal.append(cost.label)
-                    tracker = unregistered_cost_tracker.setdefault(
-                        cost.label,
-
-                    if variance >= 5:
-                        status = "Partial"
-                        partial_for_deal.append(cost.label)
-
-                if greater_flag:
-                    greater_for_deal.append(cost.label)
+        formatted_matrix, comparison_matrix = self._cost_matrices(merged, cost_columns)
+        (
+            status_codes,
+            difference_matrix,
+            percentage_matrix,
+            missing_matrix,
+            greater_matrix,
+            unregistered_matrix,
+        ) = _classify_costs(formatted_matrix, comparison_matrix, epsilon)
+        status_matrix = _COST_STATUS_LABELS[status_codes]
+
+        quantity_difference = merged["quantity_difference"].to_numpy(dtype=np.float64)
+        include_mask = (
+            (np.abs(quantity_difference) > epsilon)
+            | missing_matrix.any(axis=1)
+            | greater_matrix.any(axis=1)
+            | unregistered_matrix.any(axis=1)
+        )
+        included = np.flatnonzero(include_mask)
 
-                cost_details.append(
-                    {
-                        "cost_type": cost.label,
-                        "formatted": round(float(formatted_value), 2),
-                        "comparison": round(float(comparison_value), 2),
-                        "difference": round(float(difference), 2),
-                        "percentage": None if np.isnan(percentage) else round(float(percentage), 2),
-                        "status": status,
-                        "missing": bool(missing_flag),
-                        "greater": bool(greater_flag),
-                    }
+        cost_labels = [cost.label for cost in cost_columns]
+        deal_ids = merged["deal_id"].tolist()
+        formatted_quantities = _round_list(merged["total_quantity_formatted"].to_numpy())
+        comparison_quantities = _round_list(merged["total_quantity_comparison"].to_numpy())
+        quantity_differences = _round_list(quantity_difference)
+        percentage_variances = _round_list(merged["percentage_variance"].to_numpy())
+
+        formatted_rows = _round_list(formatted_matrix[included])
+        comparison_rows = _round_list(comparison_matrix[included])
+        difference_rows = _round_list(difference_matrix[included])
+        percentage_rows = _round_list(percentage_matrix[included])
+        status_rows = status_matrix[included].tolist()
+        missing_rows = missing_matrix[included].tolist()
+        greater_rows = greater_matrix[included].tolist()
+
+        for row, position in enumerate(included.tolist()):
+            deal_id = deal_ids[position]
+            statuses = status_rows[row]
+            cost_details = [
+                {
+                    "cost_type": label,
+                    "formatted": formatted_value,
+                    "comparison": comparison_value,
+                    "difference": difference,
+                    "percentage": percentage,
+                    "status": status,
+                    "missing": missing_flag,
+                    "greater": greater_flag,
+                }
+                for (
+                    label,
+                    formatted_value,
+                    comparison_value,
+                    difference,
+                    percentage,
+                    status,
+                    missing_flag,
+                    greater_flag,
+                ) in zip(
+                    cost_labels,
+                    formatted_rows[row],
+                    comparison_rows[row],
+                    difference_rows[row],
+                    percentage_rows[row],
+                    statuses,
+                    missing_rows[row],
+                    greater_rows[row],
                 )
+            ]
+            unregistered_for_deal = [
+                label for label, status in zip(cost_labels, statuses) if status == "Unregistered"
+            ]
+            partial_for_deal = [
+                label for label, status in zip(cost_labels, statuses) if status == "Partial"
+            ]
+            missing_for_deal = [
+                label for label, missing_flag in zip(cost_labels, missing_rows[row]) if missing_flag
+            ]
+            greater_for_deal = [
+                label for label, greater_flag in zip(cost_labels, greater_rows[row]) if greater_flag
+            ]
 
             missing_unique = sorted(set(missing_for_deal))
             greater_unique = sorted(set(greater_for_deal))
@@ -539,16 +921,7 @@ class DealComparisonAnalyzer:
 
             has_missing = bool(missing_unique)
             has_greater = bool(greater_unique)
-            should_include = (
-                has_difference
-                or has_missing
-                or has_greater
-                or bool(unregistered_for_deal)
-            )
-            if not should_include:
-                continue
 
-            analysis_indices.append(idx)
             if has_missing and has_greater:
                 deal_status_counts["both"] += 1
             elif has_greater:
@@ -569,12 +942,10 @@ class DealComparisonAnalyzer:
             deals_payload.append(
                 {
                     "deal_id": deal_id,
-                    "formatted_quantity": round(float(row["total_quantity_formatted"]), 2),
-                    "comparison_quantity": round(float(row["total_quantity_comparison"]), 2),
-                    "difference": round(float(row["quantity_difference"]), 2),
-                    "percentage_variance": None
-                    if np.isnan(row["percentage_variance"])
-                    else round(float(row["percentage_variance"]), 2),
+                    "formatted_quantity": formatted_quantities[position],
+                    "comparison_quantity": comparison_quantities[position],
+                    "difference": quantity_differences[position],
+                    "percentage_variance": percentage_variances[position],
                     "rank": 0,
                     "cost_registry_status": overall_status,
                     "costs": cost_details,
@@ -591,28 +962,16 @@ class DealComparisonAnalyzer:
                         if has_missing
                         else "aligned"
                     ),
-                    "__row_index": idx,
                 }
             )
 
-        if analysis_indices:
-            analysis_df = merged.loc[analysis_indices].copy()
-        else:
-            analysis_df = merged.iloc[0:0].copy()
-
-        if len(analysis_df):
-            analysis_df["rank"] = (
-                analysis_df["abs_difference"].rank(method="first", ascending=False).astype(int)
-            )
-            rank_lookup = analysis_df["rank"].to_dict()
-        else:
-            rank_lookup = {}
+        analysis_df = merged.iloc[included]
 
-        for deal in deals_payload:
-            row_index = deal.pop("__row_index", None)
-            deal["rank"] = int(rank_lookup.get(row_index, 0)) if row_index is not None else 0
+        # Deals are visited in abs_difference order, so their rank is their position.
+        for rank, deal in enumerate(deals_payload, start=1):
+            deal["rank"] = rank
 
-        aligned_total = max(int(len(merged) - len(analysis_indices)), 0)
+        aligned_total = int(len(merged) - len(included))
         if aligned_total:
             deal_status_counts["aligned"] += aligned_total
 
@@ -623,59 +982,80 @@ class DealComparisonAnalyzer:
             else 0.0
         )
 
-        top_deals = sorted(
-            deals_payload,
-            key=lambda d: abs(d["difference"]),
-            reverse=True,
-        )[:20]
-
-        cost_breakdown: List[Dict[str, Any]] = []
-        for cost in cost_columns:
-            formatted_series = analysis_df.get(
-                f"cost_{cost.key}_formatted", pd.Series(dtype=float)
-            )
-            comparison_series = analysis_df.get(
-                f"cost_{cost.key}_comparison", pd.Series(dtype=float)
-            )
-
-            formatted_total = float(formatted_series.sum()) if len(formatted_series) else 0.0
-            comparison_total = float(comparison_series.sum()) if len(comparison_series) else 0.0
-            difference = formatted_total - comparison_total
-            percentage = (
-                (difference / comparison_total * 100)
-                if comparison_total
-                else (np.nan if formatted_total == 0 else 100.0)
-            )
+        top_deals = heapq.nlargest(
+            20, deals_payload, key=lambda d: abs(d["difference"])
+        )
 
-            status = "Registered"
-            if formatted_total and not comparison_total:
-                status = "Unregistered"
-            elif abs(difference) > 0 and comparison_total:
-                variance = abs(difference) / (comparison_total or 1) * 100
-                if variance >= 5:
-                    status = "Partial"
+        # Unregistered cells always belong to included deals. Visit cost types in
+        # the order their first unregistered deal appears, as the row scan did.
+        # With no deal rows there is nothing to visit (argmax needs a non-empty axis).
+        unregistered_columns = np.flatnonzero(unregistered_matrix.any(axis=0))
+        if unregistered_columns.size:
+            first_unregistered = unregistered_matrix.argmax(axis=0)
+            deal_id_array = np.asarray(deal_ids, dtype=object)
+            for column in sorted(
+                unregistered_columns.tolist(), key=lambda j: (first_unregistered[j], j)
+            ):
+                mask = unregistered_matrix[:, column]
+                tracker = unregistered_cost_tracker.setdefault(
+                    cost_labels[column], {"total_difference": 0.0, "deals": []}
+                )
+                tracker["total_difference"] += float(
+                    difference_matrix[mask, column].sum()
+                )
+                tracker["deals"].extend(deal_id_array[mask].tolist())
+
+        formatted_totals = formatted_matrix[included].sum(axis=0)
+        comparison_totals = comparison_matrix[included].sum(axis=0)
+        total_differences = formatted_totals - comparison_totals
+        has_comparison_total = comparison_totals != 0
+        safe_comparison_totals = np.where(has_comparison_total, comparison_totals, 1.0)
+        total_percentages = np.where(
+            has_comparison_total,
+            total_differences / safe_comparison_totals * 100,
+            np.where(formatted_totals == 0, np.nan, 100.0),
+        )
+        total_statuses = np.select(
+            [
+                (formatted_totals != 0) & ~has_comparison_total,
+                has_comparison_total
+                & (total_differences != 0)
+                & (np.abs(total_differences) / safe_comparison_totals * 100 >= 5),
+            ],
+            ["Unregistered", "Partial"],
+            default="Registered",
+        )
 
-            cost_breakdown.append(
-                {
-                    "cost_type": cost.label,
-                    "formatted_total": round(formatted_total, 2),
-                    "comparison_total": round(comparison_total, 2),
-                    "difference": round(difference, 2),
-                    "percentage": None if np.isnan(percentage) else round(float(percentage), 2),
-                    "status": status,
-                    "missing_deals": cost_flag_counts[cost.label]["missing_deals"],
-                    "greater_deals": cost_flag_counts[cost.label]["greater_deals"],
-                }
+        cost_breakdown: List[Dict[str, Any]] = [
+            {
+                "cost_type": label,
+                "formatted_total": formatted_total,
+                "comparison_total": comparison_total,
+                "difference": difference,
+                "percentage": percentage,
+                "status": status,
+                "missing_deals": cost_flag_counts[label]["missing_deals"],
+                "greater_deals": cost_flag_counts[label]["greater_deals"],
+            }
+            for label, formatted_total, comparison_total, difference, percentage, status in zip(
+                cost_labels,
+                _round_list(formatted_totals),
+                _round_list(comparison_totals),
+                _round_list(total_differences),
+                _round_list(total_percentages),
+                total_statuses.tolist(),
             )
+        ]
 
         unregistered_costs: List[Dict[str, Any]] = []
         for cost_label, data in unregistered_cost_tracker.items():
+            deals = sorted(dict.fromkeys(data["deals"]))
             unregistered_costs.append(
                 {
                     "cost_type": cost_label,
-                    "impact": round(float(data["total_difference"]), 2),
-                    "deal_count": len(data["deals"]),
-                    "deals": sorted(data["deals"]),
+                    "impact": round(data["total_difference"], 2),
+                    "deal_count": len(deals),
+                    "deals": deals,
                 }
             )
 
@@ -737,78 +1117,48 @@ class DealComparisonAnalyzer:
     ) -> Dict[str, Any]:
         deal_ids = df["deal_id"].tolist()
         cost_labels = [cost.label for cost in cost_columns]
-        status_matrix: List[List[str]] = []
-        z_values: List[List[float]] = []
-        hover: List[List[str]] = []
 
         epsilon = 1e-6
-        for _, row in df.iterrows():
-            status_row: List[str] = []
-            value_row: List[float] = []
-            hover_row: List[str] = []
-            for cost in cost_columns:
-                formatted_value = (
-                    row.get(f"cost_{cost.key}_formatted", 0.0) if cost.formatted_column else 0.0
-                )
-                comparison_value = (
-                    row.get(f"cost_{cost.key}_comparison", 0.0)
-                    if cost.comparison_column
-                    else 0.0
-                )
-
-                if not cost.formatted_column and not cost.comparison_column:
-                    status_row.append("Missing")
-                    value_row.append(np.nan)
-                    hover_row.append("No data")
-                    continue
-
-                difference = formatted_value - comparison_value
-                if abs(formatted_value) <= epsilon and abs(comparison_value) <= epsilon:
-                    status = "Within"
-                    value = 0
-                elif abs(formatted_value) > epsilon and abs(comparison_value) <= epsilon:
-                    status = "Unregistered"
-                    value = -10
-                elif abs(formatted_value) <= epsilon and abs(comparison_value) > epsilon:
-                    status = "Missing"
-                    value = -1
-                else:
-                    percentage = (
-                        difference / comparison_value * 100 if comparison_value else 0
-                    )
-                    if percentage >= 20:
-                        status = ">20% Higher"
-                        value = 2
-                    elif percentage >= 5:
-                        status = "5-20% Higher"
-                        value = 1
-                    elif percentage <= -20:
-                        status = ">20% Lower"
-                        value = -2
-                    elif percentage <= -5:
-                        status = "5-20% Lower"
-                        value = -1
-                    else:
-                        status = "Within"
-                        value = 0
-
-                status_row.append(status)
-                value_row.append(value)
-                diff_value = float(formatted_value) - float(comparison_value)
-                direction = "↑" if diff_value > 0 else ("↓" if diff_value < 0 else "–")
-                hover_row.append(
-
+        formatted_matrix, comparison_matrix = self._cost_matrices(df, cost_columns)
+        difference_matrix = formatted_matrix - comparison_matrix
+        state = _heatmap_states(formatted_matrix, comparison_matrix, epsilon)
+        status = _HEATMAP_LABELS[state]
+        values = _HEATMAP_VALUES[state]
+
+        hover = [
+            [
+                f"{label}<br>Formatted: {_format_currency(formatted_value)}"
+                f"<br>Comparison: {_format_currency(comparison_value)}"
+                f"<br>Difference: {'↑' if diff_value > 0 else ('↓' if diff_value < 0 else '–')} "
+                f"{_format_currency(abs(diff_value))}"
+                for label, formatted_value, comparison_value, diff_value in zip(
+                    cost_labels, formatted_row, comparison_row, difference_row
                 )
+            ]
+            for formatted_row, comparison_row, difference_row in zip(
+                formatted_matrix.tolist(),
+                comparison_matrix.tolist(),
+                difference_matrix.tolist(),
+            )
+        ]
 
-            status_matrix.append(status_row)
-            z_values.append(value_row)
-            hover.append(hover_row)
+        no_data = np.array(
+            [not cost.formatted_column and not cost.comparison_column for cost in cost_columns],
+            dtype=bool,
+        )
+        if no_data.any():
+            status[:, no_data] = "Missing"
+            values = values.astype(object)
+            values[:, no_data] = np.nan
+            for hover_row in hover:
+                for column in np.flatnonzero(no_data):
+                    hover_row[column] = "No data"
 
         return {
             "deal_ids": deal_ids,
             "cost_types": cost_labels,
-            "matrix": z_values,
-            "status_matrix": status_matrix,
+            "matrix": values.tolist(),
+            "status_matrix": status.tolist(),
             "hover": hover,
         }
 
@@ -819,87 +1169,103 @@ class DealComparisonAnalyzer:
         cost_anomalies: List[Dict[str, Any]] = []
 
         if len(df) >= 2:
-            diffs = df["quantity_difference"]
-            mean = diffs.mean()
-            std = diffs.std(ddof=0)
+            diffs = df["quantity_difference"].to_numpy(dtype=np.float64)
+            mean, std = _mean_std0(diffs)
             if std > 0:
-                threshold = mean + 2 * std
-                for _, row in df.iterrows():
-                    if row["quantity_difference"] > threshold:
-                        anomalies.append(
-                            {
-                                "deal_id": row["deal_id"],
-                                "difference": round(float(row["quantity_difference"]), 2),
-                                "formatted_quantity": round(
-                                    float(row["total_quantity_formatted"]), 2
-                                ),
-                                "comparison_quantity": round(
-                                    float(row["total_quantity_comparison"]), 2
-                                ),
-                            }
-                        )
+                selected = df.loc[diffs > mean + 2 * std]
+                anomalies = [
+                    {
+                        "deal_id": deal_id,
+                        "difference": difference,
+                        "formatted_quantity": formatted_quantity,
+                        "comparison_quantity": comparison_quantity,
+                    }
+                    for deal_id, difference, formatted_quantity, comparison_quantity in zip(
+                        selected["deal_id"].tolist(),
+                        _round_list(selected["quantity_difference"].to_numpy()),
+                        _round_list(selected["total_quantity_formatted"].to_numpy()),
+                        _round_list(selected["total_quantity_comparison"].to_numpy()),
+                    )
+                ]
 
-        for cost in cost_columns:
-            formatted_col = f"cost_{cost.key}_formatted"
-            comparison_col = f"cost_{cost.key}_comparison"
-            if formatted_col not in df.columns and comparison_col not in df.columns:
-                continue
-            differences = (
-                df.get(formatted_col, pd.Series(dtype=float))
-                - df.get(comparison_col, pd.Series(dtype=float))
+        # A cost seen on one side only has no difference distribution to test.
+        available = set(df.columns)
+        paired_costs = [
+            cost
+            for cost in cost_columns
+            if cost.merged_formatted_column in available
+            and cost.merged_comparison_column in available
+        ]
+        if len(df) < 2 or not paired_costs:
+            return anomalies, cost_anomalies
+
+        cost_values = df.reindex(
+            columns=[
+                column
+                for cost in paired_costs
+                for column in (cost.merged_formatted_column, cost.merged_comparison_column)
+            ],
+            fill_value=0.0,
+        ).to_numpy(dtype=np.float64)
+        differences = cost_values[:, 0::2] - cost_values[:, 1::2]
+        mean, std = _mean_std0(differences)
+        hits = (differences > mean + 2 * std) & (std > 0)
+
+        # Transposing keeps the output grouped by cost, deals in frame order.
+        cost_index, row_index = np.nonzero(hits.T)
+        deal_ids = df["deal_id"].to_numpy()
+        cost_anomalies = [
+            {
+                "deal_id": deal_id,
+                "cost_type": paired_costs[column].label,
+                "difference": difference,
+            }
+            for deal_id, column, difference in zip(
+                deal_ids[row_index].tolist(),
+                cost_index.tolist(),
+                _round_list(differences[row_index, cost_index]),
             )
-            if len(differences) < 2:
-                continue
-            mean = differences.mean()
-            std = differences.std(ddof=0)
-            if std <= 0:
-                continue
-            threshold = mean + 2 * std
-            for _, row in df.iterrows():
-                diff_value = (
-                    row.get(formatted_col, 0.0) - row.get(comparison_col, 0.0)
-                )
-                if diff_value > threshold:
-                    cost_anomalies.append(
-                        {
-                            "deal_id": row["deal_id"],
-                            "cost_type": cost.label,
-                            "difference": round(float(diff_value), 2),
-                        }
-                    )
+        ]
 
         return anomalies, cost_anomalies
 
     def _detect_patterns(self, deals: List[Dict[str, Any]]) -> Dict[str, Any]:
-        pattern_map: Dict[Tuple[str, ...], List[str]] = {}
-        status_counts: Dict[str, int] = {
-            "Registered": 0,
-            "Partial": 0,
-            "Unregistered": 0,
-            "Missing": 0,
-        }
-
-        for deal in deals:
-            status = deal["cost_registry_status"]
-            status_counts[status] = status_counts.get(status, 0) + 1
-            unregistered = sorted(
-                cost["cost_type"]
+        status_counts: Dict[str, int] = dict.fromkeys(
+            ("Registered", "Partial", "Unregistered", "Missing"), 0
+        )
+        status_counts.update(Counter(deal["cost_registry_status"] for deal in deals))
+
+        # Long form (deal position, cost type) of every unregistered cost; each
+        # deal's set of cost types is the key its pattern is grouped under.
+        unregistered = pd.DataFrame(
+            [
+                (position, cost["cost_type"])
+                for position, deal in enumerate(deals)
                 for cost in deal["costs"]
                 if cost["status"] == "Unregistered"
+            ],
+            columns=["position", "cost_type"],
+        )
+        keys = unregistered.groupby("position")["cost_type"].agg(frozenset)
+        pattern_deals = (
+            pd.DataFrame(
+                {
+                    "key": keys.to_numpy(),
+                    "deal_id": pd.Series(
+                        [deals[position]["deal_id"] for position in keys.index],
+                        dtype=object,
+                    ),
+                }
             )
-            if unregistered:
-                key = tuple(unregistered)
-                pattern_map.setdefault(key, []).append(deal["deal_id"])
-
-        repeating_patterns = []
-        for cost_tuple, deals_for_pattern in pattern_map.items():
-            if len(deals_for_pattern) >= 2:
-                repeating_patterns.append(
-                    {
-                        "cost_types": list(cost_tuple),
-                        "deals": deals_for_pattern,
-                    }
-                )
+            .groupby("key", sort=False)["deal_id"]
+            .agg(list)
+        )
+
+        repeating_patterns = [
+            {"cost_types": sorted(cost_types), "deals": deals_for_pattern}
+            for cost_types, deals_for_pattern in pattern_deals.items()
+            if len(deals_for_pattern) >= 2
+        ]
 
         return {
             "status_counts": status_counts,
@@ -918,6 +1284,7 @@ class DealComparisonAnalyzer:
         greater_total = deal_status_counts.get("greater", 0) + deal_status_counts.get("both", 0)
         missing_total = deal_status_counts.get("missing", 0) + deal_status_counts.get("both", 0)
 
+        total_str = _format_currency(total_difference)
         if deals:
             attention_parts: List[str] = []
             if greater_total:
@@ -928,36 +1295,34 @@ class DealComparisonAnalyzer:
                 detail = ", ".join(attention_parts)
                 headline = (
                     f"{len(deals)} deals require attention ({detail}), "
-                    f"totaling {_format_currency(total_difference)} variance."
+                    f"totaling {total_str} variance."
                 )
             else:
                 headline = (
                     f"{len(deals)} deals show higher quantities in processed sheet, "
-                    f"totaling {_format_currency(total_difference)} difference."
+                    f"totaling {total_str} difference."
                 )
         else:
             headline = "No qualifying deals were found."
 
-        top_three = sorted(deals, key=lambda d: d["difference"], reverse=True)[:3]
+        top_three = heapq.nlargest(3, deals, key=lambda d: d["difference"])
         if top_three:
-            parts = [
+            top_contributors = "Top 3 deals contributing to variance: " + ", ".join(
                 f"{deal['deal_id']}: {_format_currency(deal['difference'])}"
                 for deal in top_three
-            ]
-            top_contributors = (
-                "Top 3 deals contributing to variance: " + ", ".join(parts)
             )
         else:
             top_contributors = "No significant deal variances detected."
 
-        def _top_cost(field: str) -> Optional[Dict[str, Any]]:
-            candidates = [item for item in cost_highlights if item[field] > 0]
-            if not candidates:
-                return None
-            return max(candidates, key=lambda item: item[field])
-
-        top_greater = _top_cost("greater_deals")
-        top_missing = _top_cost("missing_deals")
+        # One pass picks the first cost type with the most affected deals for
+        # each flag; counts of zero never qualify.
+        top_greater: Optional[Dict[str, Any]] = None
+        top_missing: Optional[Dict[str, Any]] = None
+        for item in cost_highlights:
+            if item["greater_deals"] > (top_greater["greater_deals"] if top_greater else 0):
+                top_greater = item
+            if item["missing_deals"] > (top_missing["missing_deals"] if top_missing else 0):
+                top_missing = item
 
         if greater_total:
             greater_summary = (
@@ -986,7 +1351,11 @@ class DealComparisonAnalyzer:
                 unregistered_costs, key=lambda item: item["impact"], default=None
             )
             if top_unregistered:
-
+                unregistered_summary = (
+                    f"{len(unregistered_costs)} unregistered cost types detected. "
+                    f"{top_unregistered['cost_type']} has the highest impact at "
+                    f"{_format_currency(top_unregistered['impact'])}."
+                )
             else:
                 unregistered_summary = "Unregistered cost details unavailable."
         else:
@@ -1006,9 +1375,9 @@ class DealComparisonAnalyzer:
                 f"Recover missing {top_missing['cost_type']} charges from the baseline workbook."
             )
         if unregistered_costs:
-            impacted = sorted(
-                unregistered_costs, key=lambda item: item["impact"], reverse=True
-            )[:2]
+            impacted = heapq.nlargest(
+                2, unregistered_costs, key=lambda item: item["impact"]
+            )
             names = ", ".join(item["cost_type"] for item in impacted)
             recommendations.append(
                 f"Ensure cost registration for high impact types: {names}."
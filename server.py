@@ -1,20 +1,36 @@
 from fastapi import FastAPI, UploadFile, Form, File
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse, FileResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from io import BytesIO
+import asyncio
+import hashlib
 import json
-from datetime import datetime
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
 from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
 from openpyxl.utils import get_column_letter, column_index_from_string
-from typing import Dict, Any, List, Set, Optional
+from typing import Dict, Any, List, Set, Optional, Tuple
 from numbers import Number
 
 from comparison import DealComparisonAnalyzer
 
 app = FastAPI(title="VARO REBILLING Excel Processor", version="1.0.0")
 
+# Excel serial dates count days from this epoch
+EXCEL_EPOCH = date(1899, 12, 30)
+
+# Font colors used to flag changed (red) and confirmed (green) cells
+HIGHLIGHT_RED = '00FF0000'
+HIGHLIGHT_GREEN = '00008000'
+
 # Add CORS middleware for local development
 app.add_middleware(
     CORSMiddleware,
@@ -42,36 +58,41 @@ class ExcelProcessor:
     def __init__(self):
         self.workbook = None
         self.lookup_tables = {}
+        self.highlights = {}  # (row, column) -> font color for the report sheet
+        self.month_header_rows = set()  # report rows holding a month header (e.g. JAN-24)
 
     def process_excel_file(
         self,
         file_data: bytes,
         settings: Dict[str, Any],
-        existing_file_data: Optional[bytes] = None
+        existing_file_data: Optional[bytes] = None,
+        use_cache: bool = True
     ) -> BytesIO:
         """Main processing function that handles both steps and formatting"""
 
-        # Load the input workbook
-        self.workbook = load_workbook(BytesIO(file_data), data_only=True)
-
-        # Validate the file structure
-        self.validate_file(settings)
-
-        # Build lookup tables for Step 2
-        self.build_lookup_tables(settings)
+        # Read phase: reuse the parsed raw workbook when the same upload comes back
+        if use_cache:
+            self.lookup_tables, step1_rows = _read_raw_workbook(file_data, settings)
+        else:
+            self.lookup_tables, step1_rows = self.read_raw_workbook(file_data, settings)
 
-        # Step 1: Build formatted report with column mapping
-        new_workbook = self.build_step1_report(settings)
+        # Step 1: Build formatted report rows with column mapping
+        report_rows = self.build_step1_report(step1_rows)
 
         # Step 2: Enrich data using business rules
-        self.enrich_step2_data(new_workbook, settings)
-
-        # Apply comprehensive Excel formatting
-        self.apply_comprehensive_formatting(new_workbook, settings)
+        self.enrich_step2_data(report_rows, settings)
 
         # Highlight differences against an existing formatted workbook if provided
+        missing_rows = []
         if existing_file_data:
-            self.highlight_differences(new_workbook, existing_file_data, settings)
+            missing_rows = self.highlight_differences(report_rows, existing_file_data, settings)
+
+        # Stream the rows out with comprehensive Excel formatting
+        new_workbook = Workbook(write_only=True)
+        self.apply_comprehensive_formatting(new_workbook, report_rows, settings)
+
+        if missing_rows:
+            self.write_missing_from_raw(new_workbook, missing_rows)
 
         # Save to BytesIO
         output = BytesIO()
@@ -80,6 +101,31 @@ class ExcelProcessor:
 
         return output
 
+    def read_raw_workbook(
+        self,
+        file_data: bytes,
+        settings: Dict[str, Any]
+    ) -> Tuple[Dict[str, Any], Tuple[Tuple[Any, ...], ...]]:
+        """Validate the raw workbook and extract everything the report needs from it"""
+
+        # Load the input workbook in streaming mode; it is only ever read row by row
+        self.workbook = load_workbook(BytesIO(file_data), data_only=True, read_only=True)
+
+        try:
+            # Validate the file structure
+            self.validate_file(settings)
+
+            # Build lookup tables for Step 2
+            self.build_lookup_tables(settings)
+
+            # Map Sheet 1 rows to the report columns
+            step1_rows = self.map_step1_rows(settings)
+        finally:
+            # Read-only workbooks keep the source archive open until closed
+            self.workbook.close()
+
+        return self.lookup_tables, step1_rows
+
     def validate_file(self, settings: Dict[str, Any]) -> None:
         """Validate that required sheets and columns exist"""
         sheet_names = self.workbook.sheetnames
@@ -95,51 +141,29 @@ class ExcelProcessor:
         if raw_sheet3 not in sheet_names:
             raise ValueError(f"Raw Sheet 3 '{raw_sheet3}' not found")
 
-        # Verify essential data exists
         sheet1 = self.workbook[raw_sheet1]
-        if sheet1.max_row < 2:
-            raise ValueError("Raw Sheet 1 must have at least one data row")
-
-        required_columns_step1 = ['B', 'AA', 'M', 'L', 'Q', 'AB', 'AD', 'AL', 'X', 'BZ']
-        required_columns_step2 = ['N', 'AQ', 'AV']
-        required_columns_step3 = ['M', 'BR', 'CN']
-
-        self.validate_required_columns(sheet1, raw_sheet1, required_columns_step1)
         sheet2 = self.workbook[raw_sheet2]
         sheet3 = self.workbook[raw_sheet3]
-        self.validate_required_columns(sheet2, raw_sheet2, required_columns_step2)
-        self.validate_required_columns(sheet3, raw_sheet3, required_columns_step3)
 
-    def validate_required_columns(self, sheet, sheet_name: str, required_columns: List[str]) -> None:
-        """Ensure the sheet includes the required columns."""
-        max_col = sheet.max_column or 0
+        # Read-only sheets trust the stored <dimension>, which may be stale; drop it so rows
+        # are read to the real end of each sheet. Required columns are checked against the
+        # widest row while build_lookup_tables reads the sheets.
+        for sheet in (sheet1, sheet2, sheet3):
+            sheet.reset_dimensions()
 
+        # Verify essential data exists (gaps and cell-less rows come back empty)
+        if next((row for row in sheet1.iter_rows(min_row=2, values_only=True) if row), None) is None:
+            raise ValueError("Raw Sheet 1 must have at least one data row")
+
+    def validate_required_columns(self, max_col: int, sheet_name: str, required_columns: List[str]) -> None:
+        """Ensure a sheet whose widest row has max_col cells includes the required columns."""
         for column in required_columns:
             column_index = column_index_from_string(column)
             if column_index > max_col:
                 raise ValueError(f"Required column {column} not found in sheet {sheet_name}")
 
-    def build_step1_report(self, settings: Dict[str, Any]) -> Workbook:
-        """Step 1: Create formatted report with proper column mapping"""
-
-        new_workbook = Workbook()
-        ws = new_workbook.active
-        ws.title = settings.get('output_sheet_name', 'Q1-Q2-Q3-Q4-2024')
-
-        # Headers A-V
-        headers = [
-            'Varo deal', 'VSA deal', 'VESSEL', 'VMAG %', 'L/C costs',
-            'Load insp', 'Discharge inspection', 'Superintendent', 'CIN insurance',
-            'CLI insurance', 'Provisional charge', 'TOTAL USD', 'VARO comments',
-            'Product', 'Hedge', 'Qty BBL', 'Inco', 'Contractual Location',
-            'Risk', 'Date', 'VSA comments', 'Additional information'
-        ]
-
-        # Add headers to row 1
-        for col, header in enumerate(headers, 1):
-            ws.cell(row=1, column=col, value=header)
-
-        # Add 1 blank row after headers (row 2)
+    def map_step1_rows(self, settings: Dict[str, Any]) -> Tuple[Tuple[Any, ...], ...]:
+        """Step 1: Map Sheet 1 rows to report columns A-V, sorted by date and deduplicated"""
 
         # Get raw data from Sheet 1
         raw_sheet1_name = settings.get('raw_sheet1_name') or self.workbook.sheetnames[0]
@@ -152,30 +176,27 @@ class ExcelProcessor:
                 raw_data.append(row)
 
         # Map raw data to new format
+        # Column mapping: B←F, C←AA, N←M, O←L, P←Q, Q←AB, R←AD, S←AL, T←AM
+        step1_fields = itemgetter(5, 26, 12, 11, 16, 27, 29, 37, 38)
         mapped_data = []
         for row in raw_data:
-            # Ensure row has enough columns
-            padded_row = list(row) + [None] * (100 - len(row))
-
-            new_row = [None] * 22  # A-V = 22 columns
-
-            # Column mapping: B←F, C←AA, N←M, O←L, P←Q, Q←AB, R←AD, S←AL, T←AM
-            new_row[1] = padded_row[5]    # B ← F (column F = index 5)
-            new_row[2] = padded_row[26]   # C ← AA (column AA = index 26)
-            new_row[13] = padded_row[12]  # N ← M (column M = index 12)
-            new_row[14] = padded_row[11]  # O ← L (column L = index 11)
-            new_row[15] = padded_row[16]  # P ← Q (column Q = index 16)
-            new_row[16] = padded_row[27]  # Q ← AB (column AB = index 27)
-            new_row[17] = padded_row[29]  # R ← AD (column AD = index 29)
-            new_row[18] = padded_row[37]  # S ← AL (column AL = index 37)
-            new_row[19] = self.parse_date(padded_row[38])  # T ← AM (column AM = index 38)
+            # Ensure row has enough columns (up to AM = index 38)
+            if len(row) < 39:
+                row = tuple(row) + (None,) * (39 - len(row))
+
+            vsa_deal, vessel, product, hedge, qty, inco, location, risk, raw_date = step1_fields(row)
+
+            # A-V = 22 columns: B, C and N-T are mapped, the rest start empty
+            new_row = [None, vsa_deal, vessel] + [None] * 10 + [
+                product, hedge, qty, inco, location, risk, self.parse_date(raw_date)
+            ] + [None] * 2
 
             mapped_data.append(new_row)
 
-        # Sort by date (column T, index 19)
+        # Sort by date (column T, index 19, already parsed during mapping)
         def date_sort_key(row):
-            date_val = self.parse_date(row[19])
-            return date_val if date_val else datetime.max
+            date_val = row[19]
+            return date_val if isinstance(date_val, datetime) else datetime.max
 
         mapped_data.sort(key=date_sort_key)
 
@@ -188,124 +209,143 @@ class ExcelProcessor:
                 if deal_value in seen_deals:
                     continue
                 seen_deals.add(deal_value)
-            filtered_data.append(row_data)
+            filtered_data.append(tuple(row_data))
 
-        # Group by month and add to worksheet
-        current_row = 3  # Start at row 3 (after header and blank row)
-        current_month = None
-        current_year = None
+        return tuple(filtered_data)
+
+    def build_step1_report(self, step1_rows: Tuple[Tuple[Any, ...], ...]) -> List[List[Any]]:
+        """Step 1: Lay out the report rows (A-V) grouped by month"""
+
+        # Headers A-V
+        headers = [
+            'Varo deal', 'VSA deal', 'VESSEL', 'VMAG %', 'L/C costs',
+            'Load insp', 'Discharge inspection', 'Superintendent', 'CIN insurance',
+            'CLI insurance', 'Provisional charge', 'TOTAL USD', 'VARO comments',
+            'Product', 'Hedge', 'Qty BBL', 'Inco', 'Contractual Location',
+            'Risk', 'Date', 'VSA comments', 'Additional information'
+        ]
+
+        # Add headers to row 1
+        rows: List[List[Any]] = [headers]
+
+        # Add 1 blank row after headers (row 2)
 
-        for row_data in filtered_data:
-            date_val = self.parse_date(row_data[19])
+        # Group by month and add to the report (rows are date-sorted, undated rows last)
+        current_row = 3  # Start at row 3 (after header and blank row)
 
-            if date_val:
-                month = date_val.month
-                year = date_val.year
+        def month_key(row):
+            date_val = row[19]
+            return (date_val.year, date_val.month) if date_val else None
 
-                if current_month != month or current_year != year:
-                    # Add spacing before new month (except first)
-                    if current_month is not None:
-                        current_row += 3  # 3 blank rows between months
+        for month, month_rows in groupby(step1_rows, key=month_key):
+            if month is not None:
+                # Add spacing before new month (except first)
+                if current_row > 3:
+                    current_row += 3  # 3 blank rows between months
 
-                    # Add month header (e.g., JAN-24)
-                    month_name = date_val.strftime('%b').upper()
-                    year_short = str(year)[-2:]
-                    month_header = f"{month_name}-{year_short}"
+                # Add month header (e.g., JAN-24)
+                month_rows = list(month_rows)
+                month_name = month_rows[0][19].strftime('%b').upper()
+                year_short = str(month[0])[-2:]
+                month_header = f"{month_name}-{year_short}"
 
-                    ws.cell(row=current_row, column=1, value=month_header)
-                    current_row += 1
+                self.place_row(rows, current_row, [month_header] + [None] * 21)
+                self.month_header_rows.add(current_row)
+                current_row += 1
 
-                    current_month = month
-                    current_year = year
+            for row_data in map(list, month_rows):
+                # Format date for display as DD/MM/YYYY
+                if row_data[19]:
+                    row_data[19] = row_data[19].strftime('%d/%m/%Y')
 
-            # Format date for display as DD/MM/YYYY
-            if row_data[19] and isinstance(row_data[19], datetime):
-                row_data[19] = row_data[19].strftime('%d/%m/%Y')
+                # Add data row
+                self.place_row(rows, current_row, row_data)
 
-            # Add data row
-            for col, value in enumerate(row_data, 1):
-                if value is not None:
-                    ws.cell(row=current_row, column=col, value=value)
+                current_row += 1
 
-            current_row += 1
+        return rows
 
-        return new_workbook
+    def place_row(self, rows: List[List[Any]], row_idx: int, values: List[Any]) -> None:
+        """Store values at a 1-based row index, padding any gap with blank rows."""
+        rows.extend([None] * 22 for _ in range(row_idx - 1 - len(rows)))
+        rows.append(values)
 
-    def enrich_step2_data(self, workbook: Workbook, settings: Dict[str, Any]) -> None:
+    def enrich_step2_data(self, rows: List[List[Any]], settings: Dict[str, Any]) -> None:
         """Step 2: Apply all 8 business rules"""
 
-        ws = workbook.active
-        locks = set()  # Track locked cells
+        whb_cif_deals = self.lookup_tables.get('whb_cif_deals', set())
+        costs_by_deal = self.lookup_tables.get('costs_by_deal', {})
+        hedge_to_br = self.lookup_tables.get('hedge_to_br', {})
+        hedge_to_cn = self.lookup_tables.get('hedge_to_cn', {})
 
         # Process each data row
-        for row_idx in range(3, ws.max_row + 1):  # Start from row 3 (after header + blank)
+        for row_idx in range(3, len(rows) + 1):  # Start from row 3 (after header + blank)
 
             # Get row values
-            row_values = [ws.cell(row=row_idx, column=col).value for col in range(1, 23)]
+            row_values = rows[row_idx - 1]
 
             # Skip empty rows and month header rows
             if not row_values[1] and not row_values[13] and not row_values[14]:  # No VSA deal, product, or hedge
                 continue
 
+            locks = bytearray(22)  # Track locked cells in this row (A-V)
+
             deal = self.normalize(row_values[1])     # VSA deal (B)
             product = self.normalize(row_values[13]) # Product (N)
             hedge = self.normalize(row_values[14])   # Hedge (O)
+            row_costs = costs_by_deal.get(deal, {})
 
             # Rule 1: WHB+CIF deals - set insurance columns I,J to 0 and lock
-            if deal and deal in self.lookup_tables.get('whb_cif_deals', set()):
-                if f"{row_idx},9" not in locks:  # Column I (index 9)
-                    self.set_numeric_cell_value(ws, row_idx, 9, 0)
-                    locks.add(f"{row_idx},9")
-                if f"{row_idx},10" not in locks:  # Column J (index 10)
-                    self.set_numeric_cell_value(ws, row_idx, 10, 0)
-                    locks.add(f"{row_idx},10")
+            if deal and deal in whb_cif_deals:
+                if not locks[8]:  # Column I (index 9)
+                    self.set_numeric_cell_value(row_values, row_idx, 9, 0)
+                    locks[8] = 1
+                if not locks[9]:  # Column J (index 10)
+                    self.set_numeric_cell_value(row_values, row_idx, 10, 0)
+                    locks[9] = 1
 
             # Rule 2: LC Costs (E) - BOT + BLC totals
-            if f"{row_idx},5" not in locks and ws.cell(row=row_idx, column=5).value != 0:
-                bot_cost = self.lookup_tables.get('costs_map', {}).get(f"{deal},BOT", 0)
-                blc_cost = self.lookup_tables.get('costs_map', {}).get(f"{deal},BLC", 0)
+            if not locks[4] and row_values[4] != 0:
+                bot_cost = row_costs.get('BOT', 0)
+                blc_cost = row_costs.get('BLC', 0)
                 total_cost = bot_cost + blc_cost
                 if total_cost != 0:
-                    self.set_numeric_cell_value(ws, row_idx, 5, total_cost)
+                    self.set_numeric_cell_value(row_values, row_idx, 5, total_cost)
 
             # Rule 3: CIN insurance (I) - CIN costs
-            if f"{row_idx},9" not in locks and ws.cell(row=row_idx, column=9).value != 0:
-                cin_cost = self.lookup_tables.get('costs_map', {}).get(f"{deal},CIN", 0)
+            if not locks[8] and row_values[8] != 0:
+                cin_cost = row_costs.get('CIN', 0)
                 if cin_cost != 0:
-                    self.set_numeric_cell_value(ws, row_idx, 9, cin_cost)
+                    self.set_numeric_cell_value(row_values, row_idx, 9, cin_cost)
 
             # Rule 4: CLI insurance (J) - CLI costs
-            if f"{row_idx},10" not in locks and ws.cell(row=row_idx, column=10).value != 0:
-                cli_cost = self.lookup_tables.get('costs_map', {}).get(f"{deal},CLI", 0)
+            if not locks[9] and row_values[9] != 0:
+                cli_cost = row_costs.get('CLI', 0)
                 if cli_cost != 0:
-                    self.set_numeric_cell_value(ws, row_idx, 10, cli_cost)
+                    self.set_numeric_cell_value(row_values, row_idx, 10, cli_cost)
 
             # Rule 5: INS/INQ/INA insurance (F) - Load inspection costs
-            if f"{row_idx},6" not in locks and ws.cell(row=row_idx, column=6).value != 0:
-                ins_cost = self.lookup_tables.get('costs_map', {}).get(f"{deal},INS", 0)
-                inq_cost = self.lookup_tables.get('costs_map', {}).get(f"{deal},INQ", 0)
-                ina_cost = self.lookup_tables.get('costs_map', {}).get(f"{deal},INA", 0)
+            if not locks[5] and row_values[5] != 0:
+                ins_cost = row_costs.get('INS', 0)
+                inq_cost = row_costs.get('INQ', 0)
+                ina_cost = row_costs.get('INA', 0)
                 total_inspection_cost = ins_cost + inq_cost + ina_cost
                 if total_inspection_cost != 0:
-                    self.set_numeric_cell_value(ws, row_idx, 6, total_inspection_cost)
+                    self.set_numeric_cell_value(row_values, row_idx, 6, total_inspection_cost)
 
             # Rule 6: TOTAL calculation (L) - SUM(E:K)
-            total = 0
-            for col in range(5, 12):  # E-K (columns 5-11)
-                val = ws.cell(row=row_idx, column=col).value
-                if val and isinstance(val, (int, float)):
-                    total += val
-            self.set_numeric_cell_value(ws, row_idx, 12, total)  # Column L
+            total = sum(val for val in row_values[4:11] if val and isinstance(val, (int, float)))  # E-K
+            self.set_numeric_cell_value(row_values, row_idx, 12, total)  # Column L
 
             # Rule 7: VSA comments (U) - from hedge lookup
-            if hedge and hedge in self.lookup_tables.get('hedge_to_br', {}):
-                br_value = self.lookup_tables['hedge_to_br'][hedge]
-                ws.cell(row=row_idx, column=21, value=br_value)  # Column U
+            if hedge and hedge in hedge_to_br:
+                br_value = hedge_to_br[hedge]
+                row_values[20] = br_value  # Column U
 
             # Rule 8: Additional information (V) - from hedge lookup
-            if hedge and hedge in self.lookup_tables.get('hedge_to_cn', {}):
-                cn_value = self.lookup_tables['hedge_to_cn'][hedge]
-                ws.cell(row=row_idx, column=22, value=cn_value)  # Column V
+            if hedge and hedge in hedge_to_cn:
+                cn_value = hedge_to_cn[hedge]
+                row_values[21] = cn_value  # Column V
 
     def build_lookup_tables(self, settings: Dict[str, Any]) -> None:
         """Build lookup tables for Step 2 business rules"""
@@ -314,57 +354,88 @@ class ExcelProcessor:
         raw_sheet2_name = settings.get('raw_sheet2_name') or self.workbook.sheetnames[1]
         raw_sheet3_name = settings.get('raw_sheet3_name') or self.workbook.sheetnames[2]
 
+        required_columns_step1 = ['B', 'AA', 'M', 'L', 'Q', 'AB', 'AD', 'AL', 'X', 'BZ']
+        required_columns_step2 = ['N', 'AQ', 'AV']
+        required_columns_step3 = ['M', 'BR', 'CN']
+
+        # Rows end at their last cell, so each pass tracks the widest one (header included)
+        # to validate the sheet's columns and pads shorter rows out to the fields it reads.
+
         # WHB+CIF deals from Sheet 1
         whb_cif_deals = set()
-        sheet1 = self.workbook[raw_sheet1_name]
-        for row in sheet1.iter_rows(min_row=2, values_only=True):
-            if row and len(row) > 77:
+        sheet1_rows = self.workbook[raw_sheet1_name].iter_rows(values_only=True)
+        max_col = len(next(sheet1_rows, ()))
+        whb_fields = itemgetter(5, 27, 77)  # Columns F, AB, BZ
+        for row in sheet1_rows:
+            if len(row) > max_col:
+                max_col = len(row)
+            if len(row) > 77:
+                deal_value, incoterm, location = whb_fields(row)
                 # Check if AB=CIF (index 27) and BZ=WHB (index 77)
-                if len(row) > 27 and len(row) > 77 and row[27] == 'CIF' and row[77] == 'WHB':
-                    deal = self.normalize(row[5])  # Column F (index 5)
+                if incoterm == 'CIF' and location == 'WHB':
+                    deal = self.normalize(deal_value)  # Column F (index 5)
                     if deal:
                         whb_cif_deals.add(deal)
-
-        # Costs map from Sheet 2
-        costs_map = {}
-        sheet2 = self.workbook[raw_sheet2_name]
-        for row in sheet2.iter_rows(min_row=2, values_only=True):
-            if row and len(row) > 47:
-                deal = self.normalize(row[13])  # Column N (index 13)
-                cost_type = self.normalize(row[42])  # Column AQ (index 42)
-                amount = self.safe_float(row[47])  # Column AV (index 47)
+        self.validate_required_columns(max_col, raw_sheet1_name, required_columns_step1)
+
+        # Costs per deal and cost type from Sheet 2
+        costs_by_deal = {}
+        sheet2_rows = self.workbook[raw_sheet2_name].iter_rows(values_only=True)
+        max_col = len(next(sheet2_rows, ()))
+        cost_fields = itemgetter(13, 42, 47)  # Columns N, AQ, AV
+        for row in sheet2_rows:
+            if len(row) > max_col:
+                max_col = len(row)
+            if len(row) > 42:
+                if len(row) < 48:
+                    row = (*row, *(None,) * (48 - len(row)))
+                deal_value, cost_type_value, amount_value = cost_fields(row)
+                deal = self.normalize(deal_value)
+                cost_type = self.normalize(cost_type_value)
 
                 if deal and cost_type:
-                    key = f"{deal},{cost_type}"
-                    costs_map[key] = costs_map.get(key, 0) + amount
+                    deal_costs = costs_by_deal.setdefault(deal, {})
+                    deal_costs[cost_type] = deal_costs.get(cost_type, 0) + self.safe_float(amount_value)
+        self.validate_required_columns(max_col, raw_sheet2_name, required_columns_step2)
 
         # Hedge maps from Sheet 3
         hedge_to_br = {}
         hedge_to_cn = {}
-        sheet3 = self.workbook[raw_sheet3_name]
-        for row in sheet3.iter_rows(min_row=2, values_only=True):
-            if row and len(row) > 91:
-                hedge = self.normalize(row[12])  # Column M (index 12)
-                br_value = row[69] if len(row) > 69 else None  # Column BR (index 69)
-                cn_value = row[91] if len(row) > 91 else None  # Column CN (index 91)
+        sheet3_rows = self.workbook[raw_sheet3_name].iter_rows(values_only=True)
+        max_col = len(next(sheet3_rows, ()))
+        hedge_fields = itemgetter(12, 69, 91)  # Columns M, BR, CN
+        for row in sheet3_rows:
+            if len(row) > max_col:
+                max_col = len(row)
+            if len(row) > 12:
+                if len(row) < 92:
+                    row = (*row, *(None,) * (92 - len(row)))
+                hedge_value, br_value, cn_value = hedge_fields(row)
+                hedge = self.normalize(hedge_value)
 
                 if hedge:
                     if br_value and hedge not in hedge_to_br:
                         hedge_to_br[hedge] = br_value
                     if cn_value and hedge not in hedge_to_cn:
                         hedge_to_cn[hedge] = cn_value
+        self.validate_required_columns(max_col, raw_sheet3_name, required_columns_step3)
 
         self.lookup_tables = {
             'whb_cif_deals': whb_cif_deals,
-            'costs_map': costs_map,
+            'costs_by_deal': costs_by_deal,
             'hedge_to_br': hedge_to_br,
             'hedge_to_cn': hedge_to_cn
         }
 
-    def apply_comprehensive_formatting(self, workbook: Workbook, settings: Dict[str, Any]) -> None:
-        """Apply all Excel formatting requirements"""
+    def apply_comprehensive_formatting(
+        self,
+        workbook: Workbook,
+        rows: List[List[Any]],
+        settings: Dict[str, Any]
+    ) -> None:
+        """Write the report rows with all Excel formatting requirements"""
 
-        ws = workbook.active
+        ws = workbook.create_sheet(title=settings.get('output_sheet_name', 'Q1-Q2-Q3-Q4-2024'))
 
         # Define styles
         header_font = Font(bold=True, size=14, name='Arial')
@@ -384,12 +455,13 @@ class ExcelProcessor:
         )
         # Removed column_l_fill - no background for column L
 
-        # Row heights
+        # Row heights (write-only sheets need these before rows are appended)
         ws.row_dimensions[1].height = 85   # Header row - 85pt
 
-        # Set all other rows to height 15
-        for row_idx in range(2, ws.max_row + 1):
-            ws.row_dimensions[row_idx].height = 15
+        # Set all other rows to height 15 through the sheet default (no per-row entries);
+        # customHeight keeps Excel from auto-growing the wrapped U/V rows
+        ws.sheet_format.defaultRowHeight = 15
+        ws.sheet_format.customHeight = True
 
         # No freeze panes
 
@@ -398,10 +470,11 @@ class ExcelProcessor:
         for idx, width in enumerate(column_widths, 1):
             ws.column_dimensions[get_column_letter(idx)].width = width
 
-        # Apply formatting to all cells
-        for row_idx in range(1, ws.max_row + 1):
-            for col_idx in range(1, 23):  # A-V
-                cell = ws.cell(row=row_idx, column=col_idx)
+        # Apply formatting to all cells and stream each row out
+        for row_idx, row_values in enumerate(rows, 1):
+            row_cells = []
+            for col_idx, value in enumerate(row_values, 1):  # A-V
+                cell = WriteOnlyCell(ws, value=value)
 
                 # Column L (TOTAL USD) - vertical borders for ALL rows including header, no background
                 if col_idx == 12:
@@ -416,18 +489,14 @@ class ExcelProcessor:
                     cell.font = header_font
                     cell.alignment = header_alignment
 
-                # Month cells formatting (column A, rows 3+)
-                elif col_idx == 1 and row_idx >= 3 and cell.value:
-                    cell_text = str(cell.value).strip().upper()
-                    # Check for month pattern (JAN-24, FEB-24, etc.)
-                    if any(month in cell_text for month in ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN',
-                                                           'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']):
-                        cell.font = month_font
-                        cell.fill = month_fill
-                        cell.alignment = month_alignment
+                # Month cells formatting (column A of the month header rows, e.g. JAN-24)
+                elif col_idx == 1 and row_idx in self.month_header_rows:
+                    cell.font = month_font
+                    cell.fill = month_fill
+                    cell.alignment = month_alignment
 
                 # Data cells formatting (rows 3+)
-                elif row_idx >= 3 and cell.value is not None:
+                elif row_idx >= 3 and value is not None:
                     # Columns U and V - left align, no borders
                     if col_idx in [21, 22]:  # U, V
                         cell.alignment = left_alignment
@@ -435,34 +504,49 @@ class ExcelProcessor:
                     else:
                         cell.alignment = center_alignment
 
+                # Red/green highlights recorded during enrichment and comparison
+                color = self.highlights.get((row_idx, col_idx))
+                if color:
+                    self.apply_font_color(cell, color)
+
+                row_cells.append(cell)
+
+            ws.append(row_cells)
+
     def highlight_differences(
         self,
-        workbook: Workbook,
+        rows: List[List[Any]],
         existing_file_data: bytes,
         settings: Dict[str, Any]
-    ) -> None:
-        """Compare generated workbook with an existing formatted workbook and highlight deltas."""
+    ) -> List[List[Any]]:
+        """Compare generated rows with an existing formatted workbook and highlight deltas.
+
+        Returns the rows for the "Missing from Raw" sheet: deals present in the
+        existing workbook that no longer appear in the raw data.
+        """
+
+        output_sheet_name = settings.get('output_sheet_name') or 'Q1-Q2-Q3-Q4-2024'
 
         try:
-            existing_wb = load_workbook(BytesIO(existing_file_data), data_only=True)
+            existing_wb = load_workbook(BytesIO(existing_file_data), data_only=True, read_only=True)
         except Exception:
             # If the formatted workbook cannot be read, skip highlighting
-            return
-
-        output_sheet_name = settings.get('output_sheet_name') or workbook.active.title
+            return []
 
-        if output_sheet_name in existing_wb.sheetnames:
-            existing_ws = existing_wb[output_sheet_name]
-        else:
-            existing_ws = existing_wb.active
+        try:
+            if output_sheet_name in existing_wb.sheetnames:
+                existing_ws = existing_wb[output_sheet_name]
+            else:
+                existing_ws = existing_wb.active
 
-        existing_rows = self.extract_existing_rows(existing_ws)
-        ws = workbook.active
+            existing_rows = self.extract_existing_rows(existing_ws)
+        finally:
+            # Read-only workbooks keep the source archive open until closed
+            existing_wb.close()
 
         seen_deals: Set[str] = set()
 
-        for row_idx in range(1, ws.max_row + 1):
-            row_values = [ws.cell(row=row_idx, column=col).value for col in range(1, 23)]
+        for row_idx, row_values in enumerate(rows, 1):
             deal_key = self.normalize(row_values[1])
 
             if not deal_key or deal_key == 'VSA DEAL':
@@ -479,57 +563,63 @@ class ExcelProcessor:
                     if not self.should_highlight_cell(col_idx, new_value):
                         continue
 
-                    cell = ws.cell(row=row_idx, column=col_idx)
-
                     if self.values_differ(new_value, old_value):
-                        self.mark_cell_red(cell)
+                        self.mark_cell_red(row_idx, col_idx)
                     elif not self.is_blank(new_value):
-                        self.mark_cell_green(cell)
+                        self.mark_cell_green(row_idx, col_idx)
             else:
                 # Entire deal is new – mark populated cells
-                for col_idx in range(1, 23):
-                    cell = ws.cell(row=row_idx, column=col_idx)
-                    if not self.is_blank(cell.value) and self.should_highlight_cell(col_idx, cell.value):
-                        self.mark_cell_red(cell)
-
-        missing_deals = sorted(set(existing_rows.keys()) - seen_deals)
-
-        if missing_deals:
-            discrepancy_ws = workbook.create_sheet(title='Missing from Raw')
-            headers = ['VSA deal', 'Product', 'Qty BBL', 'Notes']
-            discrepancy_ws.append(headers)
-
-            header_font = Font(bold=True, size=12, name='Arial')
-            for col_idx in range(1, len(headers) + 1):
-                discrepancy_ws.cell(row=1, column=col_idx).font = header_font
-
-            for row_offset, deal in enumerate(missing_deals, start=2):
-                existing_values = existing_rows[deal]
-                product = existing_values[13] if len(existing_values) > 13 else None
-                qty = existing_values[15] if len(existing_values) > 15 else None
-
-                discrepancy_ws.cell(row=row_offset, column=1, value=existing_values[1])
-                discrepancy_ws.cell(row=row_offset, column=2, value=product)
-                discrepancy_ws.cell(row=row_offset, column=3, value=qty)
-                discrepancy_ws.cell(row=row_offset, column=4, value='Not present in latest raw data')
-
-                for col_idx in range(1, 4):
-                    cell = discrepancy_ws.cell(row=row_offset, column=col_idx)
-                    if not self.is_blank(cell.value) and self.should_highlight_cell(col_idx, cell.value):
-                        self.mark_cell_red(cell)
-
-            # Set simple column widths for readability
-            column_widths = [18, 18, 14, 40]
-            for idx, width in enumerate(column_widths, 1):
-                discrepancy_ws.column_dimensions[get_column_letter(idx)].width = width
-
-    def extract_existing_rows(self, worksheet) -> Dict[str, List[Any]]:
+                for col_idx, value in enumerate(row_values, 1):
+                    if not self.is_blank(value) and self.should_highlight_cell(col_idx, value):
+                        self.mark_cell_red(row_idx, col_idx)
+
+        missing_rows = []
+        for deal in sorted(set(existing_rows.keys()) - seen_deals):
+            existing_values = existing_rows[deal]
+            product = existing_values[13] if len(existing_values) > 13 else None
+            qty = existing_values[15] if len(existing_values) > 15 else None
+            missing_rows.append([existing_values[1], product, qty, 'Not present in latest raw data'])
+
+        return missing_rows
+
+    def write_missing_from_raw(self, workbook: Workbook, missing_rows: List[List[Any]]) -> None:
+        """Add a sheet listing deals that are missing from the latest raw data."""
+
+        discrepancy_ws = workbook.create_sheet(title='Missing from Raw')
+
+        # Set simple column widths for readability
+        column_widths = [18, 18, 14, 40]
+        for idx, width in enumerate(column_widths, 1):
+            discrepancy_ws.column_dimensions[get_column_letter(idx)].width = width
+
+        headers = ['VSA deal', 'Product', 'Qty BBL', 'Notes']
+        header_font = Font(bold=True, size=12, name='Arial')
+        header_cells = []
+        for header in headers:
+            cell = WriteOnlyCell(discrepancy_ws, value=header)
+            cell.font = header_font
+            header_cells.append(cell)
+        discrepancy_ws.append(header_cells)
+
+        for row_values in missing_rows:
+            row_cells = []
+            for col_idx, value in enumerate(row_values, 1):
+                cell = WriteOnlyCell(discrepancy_ws, value=value)
+                if col_idx < 4 and not self.is_blank(value) and self.should_highlight_cell(col_idx, value):
+                    self.apply_font_color(cell, HIGHLIGHT_RED)
+                row_cells.append(cell)
+            discrepancy_ws.append(row_cells)
+
+    def extract_existing_rows(self, worksheet) -> Dict[str, Tuple[Any, ...]]:
         """Extract existing rows keyed by deal identifier from a formatted worksheet."""
 
-        data: Dict[str, List[Any]] = {}
+        data: Dict[str, Tuple[Any, ...]] = {}
 
-        for row_idx in range(2, worksheet.max_row + 1):
-            deal_value = worksheet.cell(row=row_idx, column=2).value
+        # Don't trust a stored dimension in read-only mode; read every row, padded to A-V
+        worksheet.reset_dimensions()
+
+        for row_values in worksheet.iter_rows(min_row=2, max_col=22, values_only=True):
+            deal_value = row_values[1]
 
             if self.is_blank(deal_value):
                 continue
@@ -539,7 +629,6 @@ class ExcelProcessor:
             if not deal_key or deal_key == 'VSA DEAL':
                 continue
 
-            row_values = [worksheet.cell(row=row_idx, column=col).value for col in range(1, 23)]
             data[deal_key] = row_values
 
         return data
@@ -552,6 +641,10 @@ class ExcelProcessor:
         return False
 
     def values_differ(self, new_value, old_value) -> bool:
+        # Fast path: plain numbers on both sides, the common case for highlighted cells
+        if type(new_value) in (int, float) and type(old_value) in (int, float):
+            return abs(float(new_value) - float(old_value)) > 0.0001
+
         if self.is_blank(new_value) and self.is_blank(old_value):
             return False
 
@@ -592,39 +685,46 @@ class ExcelProcessor:
 
         return self.is_numeric_value(value)
 
-    def set_numeric_cell_value(self, worksheet, row_idx: int, col_idx: int, new_value) -> None:
+    def set_numeric_cell_value(self, row_values: List[Any], row_idx: int, col_idx: int, new_value) -> None:
         """Set a numeric cell value and highlight if it changed."""
 
-        cell = worksheet.cell(row=row_idx, column=col_idx)
-        previous_value = cell.value
-        cell.value = new_value
+        previous_value = row_values[col_idx - 1]
+        row_values[col_idx - 1] = new_value
 
         if self.values_differ(new_value, previous_value) and self.should_highlight_cell(col_idx, new_value):
-            self.mark_cell_red(cell)
+            self.mark_cell_red(row_idx, col_idx)
 
     def is_numeric_value(self, value) -> bool:
         """Return True if the provided value is numeric or can be safely cast to float."""
 
         return self.coerce_to_float(value) is not None
 
-    def mark_cell_red(self, cell) -> None:
-        """Apply a red font color to highlight changes without altering other attributes."""
+    def mark_cell_red(self, row_idx: int, col_idx: int) -> None:
+        """Flag a report cell for a red font color to highlight changes."""
 
-        font = cell.font or Font(name='Arial')
-        cell.font = font.copy(color='00FF0000')
+        self.highlights[(row_idx, col_idx)] = HIGHLIGHT_RED
+
+    def mark_cell_green(self, row_idx: int, col_idx: int) -> None:
+        """Flag a report cell for a green font color to highlight matches."""
 
-    def mark_cell_green(self, cell) -> None:
-        """Apply a green font color to highlight matches without altering other attributes."""
+        self.highlights[(row_idx, col_idx)] = HIGHLIGHT_GREEN
+
+    def apply_font_color(self, cell, color: str) -> None:
+        """Apply a font color to a cell without altering other attributes."""
 
         font = cell.font or Font(name='Arial')
-        cell.font = font.copy(color='00008000')
+        cell.font = font.copy(color=color)
 
-    def normalize(self, value) -> str:
-        """Normalize values for consistent comparison"""
+    @staticmethod
+    @lru_cache(maxsize=8192, typed=True)
+    def normalize(value) -> str:
+        """Normalize values for consistent comparison (memoized, deals repeat across rows)"""
         return str(value).strip().upper() if value else ''
 
-    def parse_date(self, value) -> Optional[datetime]:
-        """Parse various date formats"""
+    @staticmethod
+    @lru_cache(maxsize=4096, typed=True)
+    def parse_date(value) -> Optional[datetime]:
+        """Parse various date formats (memoized, raw sheets repeat the same dates)"""
         if not value:
             return None
 
@@ -635,20 +735,22 @@ class ExcelProcessor:
         if isinstance(value, (int, float)):
             try:
                 # Excel date serial number (days since 1900-01-01)
-                from datetime import date, timedelta
-                base_date = date(1899, 12, 30)  # Excel epoch
-                return datetime.combine(base_date + timedelta(days=value), datetime.min.time())
-            except:
+                return datetime.combine(EXCEL_EPOCH + timedelta(days=value), datetime.min.time())
+            except (OverflowError, ValueError):
                 pass
 
         # Try parsing string date
         if isinstance(value, str):
-            try:
-                return datetime.strptime(value, '%Y-%m-%d')
-            except:
+            # Plain YYYY-MM-DD takes the fast C parser; anything else goes through strptime
+            if len(value) == 10 and value[4] == '-' and value[7] == '-':
                 try:
-                    return datetime.strptime(value, '%d/%m/%Y')
-                except:
+                    return datetime.fromisoformat(value)
+                except ValueError:
+                    pass
+            for date_format in ('%Y-%m-%d', '%d/%m/%Y'):
+                try:
+                    return datetime.strptime(value, date_format)
+                except ValueError:
                     pass
 
         return None
@@ -701,6 +803,45 @@ class ExcelProcessor:
         return None
 
 
+# Parsed raw workbooks keyed by (upload SHA-256 digest, raw sheet names), least recently used first
+_RAW_WORKBOOK_CACHE_MAX = 8
+_raw_workbook_cache: "OrderedDict[Tuple[Any, ...], Tuple[Dict[str, Any], Tuple[Tuple[Any, ...], ...]]]" = OrderedDict()
+_raw_workbook_cache_lock = threading.Lock()
+
+
+def _read_raw_workbook(
+    file_data: bytes,
+    settings: Dict[str, Any]
+) -> Tuple[Dict[str, Any], Tuple[Tuple[Any, ...], ...]]:
+    """Parse a raw workbook once per upload digest and sheet selection.
+
+    Only the parsed result (lookup tables and mapped Sheet 1 rows) is kept, for at
+    most _RAW_WORKBOOK_CACHE_MAX uploads; the uploaded bytes are never retained.
+    """
+    key = (
+        hashlib.sha256(file_data).digest(),
+        settings.get('raw_sheet1_name'),
+        settings.get('raw_sheet2_name'),
+        settings.get('raw_sheet3_name')
+    )
+
+    with _raw_workbook_cache_lock:
+        cached = _raw_workbook_cache.get(key)
+        if cached is not None:
+            _raw_workbook_cache.move_to_end(key)
+            return cached
+
+    result = ExcelProcessor().read_raw_workbook(file_data, settings)
+
+    with _raw_workbook_cache_lock:
+        _raw_workbook_cache[key] = result
+        _raw_workbook_cache.move_to_end(key)
+        while len(_raw_workbook_cache) > _RAW_WORKBOOK_CACHE_MAX:
+            _raw_workbook_cache.popitem(last=False)
+
+    return result
+
+
 comparison_analyzer = DealComparisonAnalyzer()
 
 
@@ -712,13 +853,17 @@ async def process_excel(
     raw_sheet1_name: str = Form(""),
     raw_sheet2_name: str = Form(""),
     raw_sheet3_name: str = Form(""),
-    deal_column_name: str = Form("N")
+    deal_column_name: str = Form("N"),
+    no_cache: bool = Form(False)
 ):
     """Process Excel file with all business rules and formatting"""
 
     try:
-        # Read uploaded file
-        file_data = await file.read()
+        # Read the uploaded files concurrently
+        file_data, existing_data = await asyncio.gather(
+            file.read(),
+            existing_file.read() if existing_file else asyncio.sleep(0, result=None)
+        )
 
         # Prepare settings
         settings = {
@@ -729,19 +874,21 @@ async def process_excel(
             'deal_column_name': deal_column_name
         }
 
-        existing_data = await existing_file.read() if existing_file else None
-
-        # Process the Excel file
+        # Process the Excel file in a worker thread so the event loop keeps serving requests
         processor = ExcelProcessor()
-        output_buffer = processor.process_excel_file(file_data, settings, existing_data)
+        output_buffer = await run_in_threadpool(
+            processor.process_excel_file, file_data, settings, existing_data, use_cache=not no_cache
+        )
 
         # Return formatted Excel file
         headers = {
             "Content-Disposition": "attachment; filename=formatted_output.xlsx"
         }
 
+        # Stream the rewound buffer in 64KB chunks (iterating a BytesIO would split on newlines)
+        output_buffer.seek(0)
         return StreamingResponse(
-            BytesIO(output_buffer.getvalue()),
+            iter(lambda: output_buffer.read(64 * 1024), b""),
             media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             headers=headers
         )
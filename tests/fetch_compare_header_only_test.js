@@ -0,0 +1,119 @@
+const { spawn, spawnSync } = require('child_process');
+const assert = require('assert');
+
+// Builds a workbook holding only a header row and prints it base64-encoded.
+const BUILD_HEADER_ONLY_WORKBOOK = `
+import base64, io, json, sys
+from openpyxl import Workbook
+
+wb = Workbook()
+wb.active.append(json.loads(sys.argv[1]))
+buffer = io.BytesIO()
+wb.save(buffer)
+sys.stdout.write(base64.b64encode(buffer.getvalue()).decode())
+`;
+
+function headerOnlyWorkbook(headers) {
+  const result = spawnSync('python3', ['-c', BUILD_HEADER_ONLY_WORKBOOK, JSON.stringify(headers)]);
+  if (result.status !== 0) {
+    throw new Error(`python3 failed: ${result.stderr.toString()}`);
+  }
+  return Buffer.from(result.stdout.toString(), 'base64');
+}
+
+function startServer() {
+  return new Promise((resolve, reject) => {
+    const server = spawn('python3', [
+      '-m',
+      'uvicorn',
+      'server:app',
+      '--host',
+      '127.0.0.1',
+      '--port',
+      '8003'
+    ]);
+
+    const onData = (data) => {
+      const text = data.toString();
+      if (text.includes('Application startup complete')) {
+        cleanup();
+        resolve(server);
+      }
+    };
+
+    const onError = (err) => {
+      cleanup();
+      reject(err);
+    };
+
+    const onExit = (code) => {
+      cleanup();
+      reject(new Error(`Server exited with code ${code}`));
+    };
+
+    const cleanup = () => {
+      clearTimeout(timeout);
+      server.stdout.off('data', onData);
+      server.stderr.off('data', onData);
+      server.off('error', onError);
+      server.off('exit', onExit);
+    };
+
+    const timeout = setTimeout(() => {
+      cleanup();
+      server.kill('SIGTERM');
+      reject(new Error('Timed out waiting for server startup'));
+    }, 10000);
+
+    server.stdout.on('data', onData);
+    server.stderr.on('data', onData);
+    server.on('error', onError);
+    server.on('exit', onExit);
+  });
+}
+
+async function stopServer(server) {
+  if (!server) return;
+  return new Promise((resolve) => {
+    server.once('close', resolve);
+    server.kill('SIGTERM');
+  });
+}
+
+async function runTest() {
+  const formatted = headerOnlyWorkbook([
+    'Varo deal', 'VSA deal', 'VESSEL', 'VMAG %', 'L/C costs', 'Load insp',
+    'Discharge inspection', 'Superintendent', 'CIN insurance', 'CLI insurance',
+    'Provisional charge', 'TOTAL USD', 'VARO comments', 'Product'
+  ]);
+  const comparison = headerOnlyWorkbook([
+    'VSA deal', 'Product', 'L/C costs', 'Load insp', 'Port fee', 'TOTAL USD'
+  ]);
+  const server = await startServer();
+
+  try {
+    const formData = new FormData();
+    formData.append('formatted_file', new Blob([formatted]), 'formatted.xlsx');
+    formData.append('comparison_file', new Blob([comparison]), 'comparison.xlsx');
+
+    const response = await fetch('http://127.0.0.1:8003/compare-deals', {
+      method: 'POST',
+      body: formData
+    });
+
+    const body = await response.json();
+    assert.strictEqual(response.status, 200, `Expected HTTP 200 status, got: ${JSON.stringify(body)}`);
+    assert.strictEqual(body.overview.total_deals, 0, 'Expected no deals');
+    assert.deepStrictEqual(body.deals, [], 'Expected an empty deal list');
+    assert.deepStrictEqual(body.unregistered_costs, [], 'Expected no unregistered costs');
+
+    console.log('Header-only compare fetch test passed.');
+  } finally {
+    await stopServer(server);
+  }
+}
+
+runTest().catch((error) => {
+  console.error('Header-only compare fetch test failed:', error);
+  process.exitCode = 1;
+});
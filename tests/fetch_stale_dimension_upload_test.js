@@ -0,0 +1,145 @@
+const { spawn, spawnSync } = require('child_process');
+const assert = require('assert');
+
+// Builds a raw workbook whose sheets all carry a stale <dimension ref="A1" />,
+// as written by some exporters, and prints it base64-encoded.
+const BUILD_STALE_WORKBOOK = `
+import base64, io, re, sys, zipfile
+from openpyxl import Workbook
+
+wb = Workbook()
+positions = wb.active
+positions.title = 'positions'
+positions.append(['h'] * 80)
+row = [None] * 80
+row[5], row[27], row[38], row[77] = 'D1', 'CIF', '2024-01-15', 'WHB'
+positions.append(row)
+
+costs = wb.create_sheet('costs')
+costs.append(['h'] * 48)
+row = [None] * 48
+row[13], row[42], row[47] = 'D1', 'BOT', 100
+costs.append(row)
+
+hedges = wb.create_sheet('hedges')
+hedges.append(['h'] * 92)
+
+source = io.BytesIO()
+wb.save(source)
+patched = io.BytesIO()
+with zipfile.ZipFile(io.BytesIO(source.getvalue())) as src, zipfile.ZipFile(patched, 'w') as dst:
+    for info in src.infolist():
+        data = src.read(info.filename)
+        if info.filename.startswith('xl/worksheets/'):
+            data = re.sub(rb'<dimension[^>]*/>', b'<dimension ref="A1" />', data)
+        dst.writestr(info, data)
+sys.stdout.write(base64.b64encode(patched.getvalue()).decode())
+`;
+
+// Reads the processed workbook from stdin and prints the VSA deal and L/C cost of each data row.
+const READ_OUTPUT_ROWS = `
+import io, json, sys
+from openpyxl import load_workbook
+
+ws = load_workbook(io.BytesIO(sys.stdin.buffer.read())).active
+rows = [[row[1], row[4]] for row in ws.iter_rows(min_row=3, values_only=True) if row[1]]
+print(json.dumps(rows))
+`;
+
+function runPython(script, input) {
+  const result = spawnSync('python3', ['-c', script], { input, maxBuffer: 16 * 1024 * 1024 });
+  if (result.status !== 0) {
+    throw new Error(`python3 failed: ${result.stderr.toString()}`);
+  }
+  return result.stdout.toString();
+}
+
+function startServer() {
+  return new Promise((resolve, reject) => {
+    const server = spawn('python3', [
+      '-m',
+      'uvicorn',
+      'server:app',
+      '--host',
+      '127.0.0.1',
+      '--port',
+      '8002'
+    ]);
+
+    const onData = (data) => {
+      const text = data.toString();
+      if (text.includes('Application startup complete')) {
+        cleanup();
+        resolve(server);
+      }
+    };
+
+    const onError = (err) => {
+      cleanup();
+      reject(err);
+    };
+
+    const onExit = (code) => {
+      cleanup();
+      reject(new Error(`Server exited with code ${code}`));
+    };
+
+    const cleanup = () => {
+      clearTimeout(timeout);
+      server.stdout.off('data', onData);
+      server.stderr.off('data', onData);
+      server.off('error', onError);
+      server.off('exit', onExit);
+    };
+
+    const timeout = setTimeout(() => {
+      cleanup();
+      server.kill('SIGTERM');
+      reject(new Error('Timed out waiting for server startup'));
+    }, 10000);
+
+    server.stdout.on('data', onData);
+    server.stderr.on('data', onData);
+    server.on('error', onError);
+    server.on('exit', onExit);
+  });
+}
+
+async function stopServer(server) {
+  if (!server) return;
+  return new Promise((resolve) => {
+    server.once('close', resolve);
+    server.kill('SIGTERM');
+  });
+}
+
+async function runTest() {
+  const workbook = Buffer.from(runPython(BUILD_STALE_WORKBOOK), 'base64');
+  const server = await startServer();
+
+  try {
+    const formData = new FormData();
+    const blob = new Blob([workbook], { type: 'application/octet-stream' });
+    formData.append('file', blob, 'stale_dimension.xlsx');
+
+    const response = await fetch('http://127.0.0.1:8002/process', {
+      method: 'POST',
+      body: formData
+    });
+
+    const body = Buffer.from(await response.arrayBuffer());
+    assert.strictEqual(response.status, 200, `Expected HTTP 200 status, got: ${body.toString()}`);
+
+    const rows = JSON.parse(runPython(READ_OUTPUT_ROWS, body));
+    assert.deepStrictEqual(rows, [['D1', 100]], 'Expected the deal row with its Sheet 2 cost');
+
+    console.log('Stale dimension upload fetch test passed.');
+  } finally {
+    await stopServer(server);
+  }
+}
+
+runTest().catch((error) => {
+  console.error('Stale dimension upload fetch test failed:', error);
+  process.exitCode = 1;
+});